@@ -1,11 +1,15 @@
 import streamlit as st
 from core.db import init_engine_and_create, get_session, ensure_db
+from core.snapshots import run_scheduled_snapshot
 from core.models import Category, Transaction, Rule, Assignment, Setting
 from sqlalchemy import select, func
+from ui import workspace_sidebar
 
 st.set_page_config(page_title="Expenses Dashboard", layout="wide")
+workspace_sidebar()
 
 ensure_db()
+run_scheduled_snapshot()
 
 st.title("Cake Atelier — Expenses")
 st.write("Use the pages on the left: Dashboard • Transactions • Categories & Rules • Settings")
@@ -1,18 +1,60 @@
 from __future__ import annotations
-from sqlalchemy import select
+from datetime import datetime
+from sqlalchemy import select, literal, null, true
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from .db import get_session
 from .models import Transaction, Assignment, Category, Rule
+from .queries import transaction_filter_conditions
 
-def set_category_manual(tx_ids: list[int], category_id: int):
+def _upsert_manual(source_select):
+    """INSERT ... SELECT transaction ids, overwriting existing assignments."""
+    stmt = sqlite_insert(Assignment).from_select(
+        ['transaction_id', 'category_id', 'source', 'rule_id', 'assigned_at'], source_select
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[Assignment.transaction_id],
+        set_={
+            'category_id': stmt.excluded.category_id,
+            'source': stmt.excluded.source,
+            'rule_id': None,
+            'confidence': None,
+            'assigned_at': stmt.excluded.assigned_at,
+        },
+    )
     with get_session() as s:
-        for tx_id in tx_ids:
-            a = s.scalar(select(Assignment).where(Assignment.transaction_id == tx_id))
-            if a:
-                a.category_id = category_id
-                a.source = 'manual'
-                a.rule_id = None
-            else:
-                s.add(Assignment(transaction_id=tx_id, category_id=category_id, source='manual', rule_id=None))
+        return s.execute(stmt).rowcount
+
+def _manual_columns(category_id: int):
+    return (
+        Transaction.id,
+        literal(category_id),
+        literal('manual'),
+        null(),
+        literal(datetime.utcnow()),
+    )
+
+def set_category_manual(tx_ids: list[int], category_id: int):
+    if not tx_ids:
+        return 0
+    return _upsert_manual(
+        select(*_manual_columns(category_id)).where(Transaction.id.in_(tx_ids))
+    )
+
+def set_category_by_filter(filters: dict, category_id: int) -> int:
+    """Assign ``category_id`` to every transaction matching the browser filters.
+
+    Takes the same filter dict as ``fetch_transactions``; matching IDs are
+    resolved and written in a single UPSERT ... SELECT statement. Returns the
+    number of assignments written.
+    """
+    q = (
+        select(*_manual_columns(category_id))
+        .select_from(Transaction)
+        .join(Assignment, Assignment.transaction_id == Transaction.id, isouter=True)
+        # SQLite needs a WHERE clause to tell ON CONFLICT apart from a join's ON
+        .where(true(), *transaction_filter_conditions(filters))
+    )
+    return _upsert_manual(q)
 
 def create_rule_from_tx(tx_id: int, category_id: int, match_type='contains', field='counterparty'):
     with get_session() as s:
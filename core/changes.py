@@ -0,0 +1,99 @@
+"""Reading and compacting the change journal (``change_log``).
+
+Triggers created in ``core.db`` append one entry per inserted, updated or
+deleted row of transactions, assignments, rules and categories, so every
+write path (ORM, bulk statements, raw SQL) is covered. Each entry has a
+monotonic ``seq``; consumers remember the last ``seq`` they processed under a
+name and ask for everything after it.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+from datetime import datetime
+
+from sqlalchemy import delete, func, select
+
+from .db import get_session
+from .models import ChangeLog, Setting
+
+CURSOR_PREFIX = "cdc_cursor:"
+
+
+@dataclass(frozen=True)
+class Change:
+    seq: int
+    table: str
+    row_id: int
+    op: str  # 'I' | 'U' | 'D'
+    changed_at: datetime
+
+
+def latest_seq() -> int:
+    with get_session() as s:
+        return s.scalar(select(func.max(ChangeLog.seq))) or 0
+
+
+def read_changes(after: int = 0, tables: list[str] | None = None, limit: int | None = None) -> list[Change]:
+    """Entries with ``seq > after`` in sequence order."""
+    q = select(ChangeLog).where(ChangeLog.seq > after).order_by(ChangeLog.seq)
+    if tables:
+        q = q.where(ChangeLog.table_name.in_(tables))
+    if limit:
+        q = q.limit(limit)
+    with get_session() as s:
+        return [
+            Change(c.seq, c.table_name, c.row_id, c.op, c.changed_at)
+            for c in s.scalars(q)
+        ]
+
+
+def changed_ids(after: int = 0, table: str = "transactions") -> tuple[set[int], int]:
+    """Distinct row ids of ``table`` touched after ``after`` and the seq read up to."""
+    with get_session() as s:
+        # bound the read by upto so entries written in between are left for next time
+        upto = s.scalar(select(func.max(ChangeLog.seq))) or after
+        rows = s.scalars(
+            select(ChangeLog.row_id)
+            .where(ChangeLog.seq > after, ChangeLog.seq <= upto, ChangeLog.table_name == table)
+        ).all()
+    return set(rows), upto
+
+
+def get_cursor(consumer: str) -> int:
+    with get_session() as s:
+        row = s.get(Setting, CURSOR_PREFIX + consumer)
+        return int(row.value) if row else 0
+
+
+def set_cursor(consumer: str, seq: int):
+    with get_session() as s:
+        s.merge(Setting(key=CURSOR_PREFIX + consumer, value=str(seq)))
+
+
+def poll(consumer: str, tables: list[str] | None = None, limit: int | None = None) -> list[Change]:
+    """Changes not yet seen by ``consumer``; call ``set_cursor`` once processed."""
+    return read_changes(get_cursor(consumer), tables=tables, limit=limit)
+
+
+def compact(upto: int | None = None) -> int:
+    """Drop journal entries every consumer has already processed.
+
+    ``upto`` defaults to the lowest registered consumer cursor (or the latest
+    seq when no consumer is registered). Within the remaining entries only
+    the newest entry per (table, row) is kept. Returns entries deleted.
+    """
+    with get_session() as s:
+        if upto is None:
+            cursors = [int(v) for v in s.scalars(
+                select(Setting.value).where(Setting.key.like(CURSOR_PREFIX + "%"))
+            )]
+            upto = min(cursors) if cursors else (s.scalar(select(func.max(ChangeLog.seq))) or 0)
+        deleted = s.execute(delete(ChangeLog).where(ChangeLog.seq <= upto)).rowcount
+        newest = (
+            select(func.max(ChangeLog.seq))
+            .group_by(ChangeLog.table_name, ChangeLog.row_id)
+            .scalar_subquery()
+        )
+        deleted += s.execute(delete(ChangeLog).where(ChangeLog.seq.not_in(newest))).rowcount
+    return deleted
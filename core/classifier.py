@@ -0,0 +1,203 @@
+"""ML category suggestions for transactions that no rule matches.
+
+A char n-gram TF-IDF over the normalized counterparty/reference plus simple
+amount features feeds a linear model trained on existing rule/manual
+assignments. The fitted pipeline is saved next to the database and reused
+until enough new labels have accumulated to warrant a retrain.
+"""
+
+from __future__ import annotations
+
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import func, select, update, delete, or_
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from . import db
+from .db import get_session
+from .models import Assignment, Transaction
+from .utils_text import normalize_text
+
+# Retrain once this many labels were added or changed since the last fit
+MIN_NEW_LABELS = 50
+# Classes need at least this many examples to be learned
+MIN_CLASS_EXAMPLES = 2
+PREDICT_BATCH = 20000
+
+_cache: dict = {}  # path -> (mtime, bundle)
+
+
+def model_path() -> Path:
+    return db.db_path().parent / "models" / f"{db.db_path().stem}_classifier.joblib"
+
+
+def _amount_features(amounts):
+    a = np.asarray(amounts, dtype=float).reshape(-1, 1)
+    return np.hstack([np.log1p(np.abs(a)), (a > 0).astype(float)])
+
+
+def _frame(rows) -> pd.DataFrame:
+    df = pd.DataFrame(rows, columns=["id", "counterparty", "reference", "amount"])
+    df["text"] = (
+        df["counterparty"].map(normalize_text) + " | " + df["reference"].map(normalize_text)
+    )
+    return df
+
+
+def _build_pipeline():
+    from sklearn.compose import ColumnTransformer
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from sklearn.linear_model import LogisticRegression
+    from sklearn.pipeline import Pipeline
+    from sklearn.preprocessing import FunctionTransformer
+
+    features = ColumnTransformer([
+        ("text", TfidfVectorizer(analyzer="char_wb", ngram_range=(2, 4), sublinear_tf=True, min_df=1), "text"),
+        ("amount", FunctionTransformer(_amount_features), ["amount"]),
+    ])
+    return Pipeline([
+        ("features", features),
+        ("clf", LogisticRegression(max_iter=1000, C=10.0)),
+    ])
+
+
+def _labeled_rows(s):
+    return s.execute(
+        select(Transaction.id, Transaction.counterparty, Transaction.reference,
+               Transaction.amount, Assignment.category_id)
+        .join(Assignment, Assignment.transaction_id == Transaction.id)
+        .where(Assignment.source.in_(("rule", "manual")), Transaction.is_income == False)  # noqa
+    ).all()
+
+
+def train_model():
+    """Fit the classifier on all rule/manual assignments and save it.
+
+    Returns the saved bundle, or ``None`` if there are fewer than two
+    categories with enough examples.
+    """
+    import joblib
+
+    trained_at = datetime.utcnow()
+    with get_session() as s:
+        rows = _labeled_rows(s)
+    df = _frame([r[:4] for r in rows])
+    df["label"] = [r[4] for r in rows]
+    counts = df["label"].value_counts()
+    df = df[df["label"].isin(counts[counts >= MIN_CLASS_EXAMPLES].index)]
+    if df["label"].nunique() < 2:
+        return None
+    pipeline = _build_pipeline()
+    pipeline.fit(df[["text", "amount"]], df["label"])
+    bundle = {"pipeline": pipeline, "trained_at": trained_at, "n_labels": len(df)}
+    path = model_path()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    joblib.dump(bundle, path)
+    _cache.pop(str(path), None)
+    return bundle
+
+
+def load_model():
+    """Return the saved bundle (cached per file mtime) or ``None``."""
+    import joblib
+
+    path = model_path()
+    if not path.exists():
+        return None
+    mtime = path.stat().st_mtime
+    hit = _cache.get(str(path))
+    if hit and hit[0] == mtime:
+        return hit[1]
+    bundle = joblib.load(path)
+    _cache[str(path)] = (mtime, bundle)
+    return bundle
+
+
+def new_label_count(since: datetime) -> int:
+    with get_session() as s:
+        return s.scalar(
+            select(func.count(Assignment.id)).where(
+                Assignment.source.in_(("rule", "manual")), Assignment.assigned_at > since
+            )
+        ) or 0
+
+
+def ensure_model(min_new_labels: int = MIN_NEW_LABELS):
+    """Load the saved model, retraining first if none exists or enough new labels arrived."""
+    bundle = load_model()
+    if bundle is None or new_label_count(bundle["trained_at"]) >= min_new_labels:
+        bundle = train_model() or bundle
+    return bundle
+
+
+def suggest_categories(min_new_labels: int = MIN_NEW_LABELS) -> int:
+    """Predict categories for every uncategorized expense in sparse batches.
+
+    Predictions are stored as ``source='model'`` assignments with a
+    confidence; existing suggestions are refreshed, real assignments are
+    never touched. Returns the number of suggestions written.
+    """
+    bundle = ensure_model(min_new_labels)
+    if bundle is None:
+        return 0
+    pipeline = bundle["pipeline"]
+    classes = pipeline.classes_
+    with get_session() as s:
+        rows = s.execute(
+            select(Transaction.id, Transaction.counterparty, Transaction.reference, Transaction.amount)
+            .join(Assignment, Assignment.transaction_id == Transaction.id, isouter=True)
+            .where(Transaction.is_income == False,  # noqa
+                   or_(Assignment.id.is_(None), Assignment.source == "model"))
+        ).all()
+    now = datetime.utcnow()
+    written = 0
+    for start in range(0, len(rows), PREDICT_BATCH):
+        df = _frame(rows[start:start + PREDICT_BATCH])
+        proba = pipeline.predict_proba(df[["text", "amount"]])
+        best = proba.argmax(axis=1)
+        values = [
+            {
+                "transaction_id": int(tx_id),
+                "category_id": int(classes[b]),
+                "source": "model",
+                "rule_id": None,
+                "confidence": float(proba[i, b]),
+                "assigned_at": now,
+            }
+            for i, (tx_id, b) in enumerate(zip(df["id"], best))
+        ]
+        stmt = sqlite_insert(Assignment)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[Assignment.transaction_id],
+            set_={
+                "category_id": stmt.excluded.category_id,
+                "confidence": stmt.excluded.confidence,
+                "assigned_at": stmt.excluded.assigned_at,
+            },
+            where=Assignment.source == "model",
+        )
+        with get_session() as s:
+            s.execute(stmt, values)
+        written += len(values)
+    return written
+
+
+def accept_suggestions(min_confidence: float = 0.0, tx_ids: list[int] | None = None) -> int:
+    """Turn model suggestions into manual assignments. Returns rows accepted."""
+    q = update(Assignment).where(
+        Assignment.source == "model", Assignment.confidence >= min_confidence
+    )
+    if tx_ids is not None:
+        q = q.where(Assignment.transaction_id.in_(tx_ids))
+    with get_session() as s:
+        return s.execute(
+            q.values(source="manual", confidence=None, assigned_at=datetime.utcnow())
+        ).rowcount
+
+
+def discard_suggestions() -> int:
+    with get_session() as s:
+        return s.execute(delete(Assignment).where(Assignment.source == "model")).rowcount
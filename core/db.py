@@ -1,45 +1,276 @@
+import re
+import threading
+import time
+from collections import OrderedDict
 from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
 from pathlib import Path
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.orm import sessionmaker, DeclarativeBase
 import os
 
-DB_PATH = Path(__file__).resolve().parent.parent / "data" / "expenses.db"
+DATA_DIR = Path(__file__).resolve().parent.parent / "data"
+DEFAULT_WORKSPACE = "expenses"
+DB_PATH = DATA_DIR / f"{DEFAULT_WORKSPACE}.db"
+
+# Open workspaces are kept in an LRU pool; the least recently used engine is
+# disposed once more than MAX_OPEN_WORKSPACES are open, and any engine unused
+# for IDLE_DISPOSE_SECONDS is disposed on the next pool access.
+MAX_OPEN_WORKSPACES = int(os.environ.get("EXPENSES_MAX_OPEN_WORKSPACES", 4))
+IDLE_DISPOSE_SECONDS = float(os.environ.get("EXPENSES_IDLE_DISPOSE_SECONDS", 900))
+
+WORKSPACE_NAME_RE = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_-]{0,63}$")
 
 class Base(DeclarativeBase):
     pass
 
-_engine = None
-_Session = None
 
-def init_engine_and_create():
-    global _engine, _Session
-    DB_PATH.parent.mkdir(parents=True, exist_ok=True)
-    _engine = create_engine(f"sqlite:///{DB_PATH}", future=True)
+@dataclass
+class Workspace:
+    name: str
+    path: Path
+    engine: Engine
+    Session: sessionmaker
+    fts_enabled: bool
+    last_used: float
+
+
+_pool: "OrderedDict[str, Workspace]" = OrderedDict()
+_pool_lock = threading.RLock()
+# Bound per thread/task, so concurrent Streamlit sessions can use different workspaces
+_current: ContextVar[str] = ContextVar("workspace", default=DEFAULT_WORKSPACE)
+
+
+def workspace_path(name: str) -> Path:
+    if not WORKSPACE_NAME_RE.match(name):
+        raise ValueError(f"Invalid workspace name: {name!r}")
+    return DATA_DIR / f"{name}.db"
+
+
+def list_workspaces() -> list[str]:
+    """Workspaces with a database file, plus the default one."""
+    names = {DEFAULT_WORKSPACE}
+    if DATA_DIR.exists():
+        names.update(p.stem for p in DATA_DIR.glob("*.db") if WORKSPACE_NAME_RE.match(p.stem))
+    return sorted(names)
+
+
+def current_workspace() -> str:
+    return _current.get()
+
+
+def set_workspace(name: str):
+    """Bind ``name`` as the workspace for the current thread/context."""
+    workspace_path(name)
+    _current.set(name)
+
+
+@contextmanager
+def use_workspace(name: str):
+    workspace_path(name)
+    token = _current.set(name)
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+def db_path() -> Path:
+    """Database file of the current workspace."""
+    return workspace_path(current_workspace())
+
+
+def _open_workspace(name: str) -> Workspace:
+    path = workspace_path(name)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    engine = create_engine(f"sqlite:///{path}", future=True)
+    event.listen(engine, "connect", _set_sqlite_pragmas)
     from .models import Base as MBase  # noqa
-    MBase.metadata.create_all(_engine)
-    upgrade_schema_if_needed(_engine)
-    _Session = sessionmaker(_engine, expire_on_commit=False, future=True)
+    MBase.metadata.create_all(engine)
+    fts = upgrade_schema_if_needed(engine)
+    session = sessionmaker(engine, expire_on_commit=False, future=True)
+    return Workspace(name, path, engine, session, fts, time.monotonic())
+
+
+def _evict(now: float, keep: str):
+    while len(_pool) > MAX_OPEN_WORKSPACES:
+        _, ws = _pool.popitem(last=False)
+        ws.engine.dispose()
+    for name in [n for n, ws in _pool.items() if n != keep and now - ws.last_used > IDLE_DISPOSE_SECONDS]:
+        _pool.pop(name).engine.dispose()
+
+
+def workspace(name: str | None = None) -> Workspace:
+    """Pooled engine and session factory of a workspace, opened on first use."""
+    name = name or current_workspace()
+    now = time.monotonic()
+    with _pool_lock:
+        ws = _pool.get(name)
+        if ws is None:
+            ws = _pool[name] = _open_workspace(name)
+        ws.last_used = now
+        _pool.move_to_end(name)
+        _evict(now, keep=name)
+    return ws
+
+
+def dispose_workspace(name: str | None = None):
+    with _pool_lock:
+        ws = _pool.pop(name or current_workspace(), None)
+    if ws is not None:
+        ws.engine.dispose()
+
+
+def dispose_all():
+    with _pool_lock:
+        while _pool:
+            _pool.popitem()[1].engine.dispose()
+
+
+def init_engine_and_create():
+    workspace()
+
+
+def _set_sqlite_pragmas(dbapi_conn, _record):
+    # WAL lets readers (including online backups) run alongside a writer
+    cur = dbapi_conn.cursor()
+    cur.execute("PRAGMA journal_mode=WAL")
+    cur.execute("PRAGMA busy_timeout=5000")
+    cur.close()
 
 
 def upgrade_schema_if_needed(engine):
-    """Apply simple in-place upgrades for existing SQLite DBs."""
+    """Apply simple in-place upgrades for existing SQLite DBs. Returns whether FTS is available."""
     with engine.begin() as conn:
         existing_cols = {row[1] for row in conn.execute(text("PRAGMA table_info(rules)"))}
         if "amount_min" not in existing_cols:
             conn.execute(text("ALTER TABLE rules ADD COLUMN amount_min FLOAT"))
         if "amount_max" not in existing_cols:
             conn.execute(text("ALTER TABLE rules ADD COLUMN amount_max FLOAT"))
+        assignment_cols = {row[1] for row in conn.execute(text("PRAGMA table_info(assignments)"))}
+        if "confidence" not in assignment_cols:
+            conn.execute(text("ALTER TABLE assignments ADD COLUMN confidence FLOAT"))
+        indexes = {row[1] for row in conn.execute(text("PRAGMA index_list(rules)"))}
+        if "ux_rules_key" not in indexes:
+            # Collapse rules that are identical in every setting onto one copy,
+            # preferring an enabled rule, then the oldest
+            conn.execute(text("DROP TABLE IF EXISTS temp.rule_keep"))
+            conn.execute(text("""
+                CREATE TEMP TABLE rule_keep AS
+                SELECT id, FIRST_VALUE(id) OVER (
+                    PARTITION BY category_id, field, match_type, pattern,
+                                 amount_min, amount_max, case_sensitive
+                    ORDER BY enabled DESC, id) AS keep_id
+                FROM rules
+            """))
+            conn.execute(text("""
+                UPDATE assignments SET rule_id = (
+                    SELECT keep_id FROM rule_keep WHERE rule_keep.id = assignments.rule_id)
+                WHERE rule_id IN (SELECT id FROM rule_keep WHERE id != keep_id)
+            """))
+            conn.execute(text("DELETE FROM rules WHERE id IN (SELECT id FROM rule_keep WHERE id != keep_id)"))
+            conn.execute(text("DROP TABLE rule_keep"))
+            # Rules sharing a key but differing in amount range or case are left
+            # alone (see rules.rule_key_conflicts); the index waits until resolved
+            conflicts = conn.execute(text("""
+                SELECT 1 FROM rules GROUP BY category_id, field, match_type, pattern
+                HAVING COUNT(*) > 1 LIMIT 1
+            """)).first()
+            if not conflicts:
+                conn.execute(text(
+                    "CREATE UNIQUE INDEX ux_rules_key ON rules (category_id, field, match_type, pattern)"
+                ))
+    fts = create_fts_index(engine)
+    create_change_triggers(engine)
+    return fts
+
+
+FTS_DDL = [
+    """CREATE VIRTUAL TABLE transactions_fts USING fts5(
+        counterparty, reference, content='transactions', content_rowid='id',
+        tokenize='trigram')""",
+    """CREATE TRIGGER transactions_fts_ai AFTER INSERT ON transactions BEGIN
+        INSERT INTO transactions_fts(rowid, counterparty, reference)
+        VALUES (new.id, new.counterparty, new.reference);
+    END""",
+    """CREATE TRIGGER transactions_fts_ad AFTER DELETE ON transactions BEGIN
+        INSERT INTO transactions_fts(transactions_fts, rowid, counterparty, reference)
+        VALUES ('delete', old.id, old.counterparty, old.reference);
+    END""",
+    """CREATE TRIGGER transactions_fts_au AFTER UPDATE OF counterparty, reference ON transactions BEGIN
+        INSERT INTO transactions_fts(transactions_fts, rowid, counterparty, reference)
+        VALUES ('delete', old.id, old.counterparty, old.reference);
+        INSERT INTO transactions_fts(rowid, counterparty, reference)
+        VALUES (new.id, new.counterparty, new.reference);
+    END""",
+]
+
+
+def create_fts_index(engine) -> bool:
+    """Create and backfill the trigram FTS5 index over counterparty/reference.
+
+    Returns False if this SQLite build lacks FTS5 or the trigram tokenizer
+    (< 3.34); searches then fall back to LIKE.
+    """
+    with engine.begin() as conn:
+        exists = conn.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE name = 'transactions_fts'"
+        )).first()
+        if exists:
+            return True
+    try:
+        with engine.begin() as conn:
+            for ddl in FTS_DDL:
+                conn.execute(text(ddl))
+            conn.execute(text("INSERT INTO transactions_fts(transactions_fts) VALUES ('rebuild')"))
+        return True
+    except OperationalError:
+        return False
+
+CHANGE_TRACKED_TABLES = {
+    "transactions": "id",
+    "assignments": "transaction_id",
+    "rules": "id",
+    "categories": "id",
+}
+
+
+def create_change_triggers(engine):
+    """Journal every insert/update/delete on the tracked tables into change_log.
+
+    Assignments are keyed by transaction id, the natural key consumers use.
+    """
+    with engine.begin() as conn:
+        existing = {row[0] for row in conn.execute(text(
+            "SELECT name FROM sqlite_master WHERE type = 'trigger'"
+        ))}
+        for table, key in CHANGE_TRACKED_TABLES.items():
+            for op, event, ref in (("I", "INSERT", "new"), ("U", "UPDATE", "new"), ("D", "DELETE", "old")):
+                name = f"{table}_cdc_{op.lower()}"
+                if name in existing:
+                    continue
+                conn.execute(text(f"""
+                    CREATE TRIGGER {name} AFTER {event} ON {table} BEGIN
+                        INSERT INTO change_log (table_name, row_id, op)
+                        VALUES ('{table}', {ref}.{key}, '{op}');
+                    END
+                """))
 
 def ensure_db():
-    global _engine
-    if _engine is None:
-        init_engine_and_create()
+    workspace()
+
+def get_engine():
+    return workspace().engine
+
+def fts_enabled() -> bool:
+    return workspace().fts_enabled
 
 @contextmanager
 def get_session():
-    ensure_db()
-    s = _Session()
+    s = workspace().Session()
     try:
         yield s
         s.commit()
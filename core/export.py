@@ -0,0 +1,187 @@
+"""Streaming exports of transactions, categories and rules to Google Drive."""
+
+from __future__ import annotations
+
+import gzip
+import io
+import tempfile
+from contextvars import copy_context
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+from sqlalchemy import text
+
+from . import gdrive
+from . import db, partitions
+from .db import get_engine
+from .gdrive_config import EXPORT_FORMAT
+
+# Rows fetched from SQLite per chunk; only one chunk is held in memory.
+CHUNK_ROWS = 5000
+# Exports smaller than this stay in memory, larger ones spill to a temp file.
+SPOOL_MAX_BYTES = 16 * 1024 * 1024
+
+# One partition's transactions with their category id; the transactions
+# export UNIONs this over the hot database and every archived year.
+TX_PARTITION_SQL = """
+        SELECT t.id, t.completed_at, t.counterparty, t.reference, t.amount, a.category_id
+        FROM {schema}.transactions t
+        -- unaccepted ML suggestions are not categories yet
+        LEFT JOIN {schema}.assignments a ON a.transaction_id = t.id AND a.source != 'model'
+"""
+
+# name -> (query, column dtypes). Column names match the CSV headers the
+# Drive import handlers expect. Dates use the Finom layout so an exported
+# transactions file can be ingested again with ``ingest_csv``. ``{partitions}``
+# is replaced with TX_PARTITION_SQL for every partition.
+EXPORTS = {
+    "transactions": (
+        """
+        SELECT t.id AS "ID",
+               strftime('%d.%m.%Y %H:%M:%S', t.completed_at) AS "Completed date",
+               t.counterparty AS "Counterparty name",
+               t.reference AS "Reference",
+               t.amount AS "Amount",
+               c.name AS "Category"
+        FROM ({partitions}) t
+        LEFT JOIN categories c ON c.id = t.category_id
+        ORDER BY t.id
+        """,
+        {
+            "ID": "Int64",
+            "Completed date": "string",
+            "Counterparty name": "string",
+            "Reference": "string",
+            "Amount": "float64",
+            "Category": "string",
+        },
+    ),
+    "categories": (
+        """
+        SELECT id AS "ID", name AS "Name", description AS "Description",
+               is_active AS "Active"
+        FROM categories
+        ORDER BY name
+        """,
+        {"ID": "Int64", "Name": "string", "Description": "string", "Active": "boolean"},
+    ),
+    "rules": (
+        """
+        SELECT r.id AS "ID", r.category_id AS "Category ID", c.name AS "Category",
+               r.field AS "Field", r.match_type AS "Type", r.pattern AS "Pattern",
+               r.amount_min AS "Amount Min", r.amount_max AS "Amount Max",
+               r.enabled AS "Enabled"
+        FROM rules r
+        LEFT JOIN categories c ON c.id = r.category_id
+        ORDER BY r.id
+        """,
+        {
+            "ID": "Int64",
+            "Category ID": "Int64",
+            "Category": "string",
+            "Field": "string",
+            "Type": "string",
+            "Pattern": "string",
+            "Amount Min": "float64",
+            "Amount Max": "float64",
+            "Enabled": "boolean",
+        },
+    ),
+}
+
+MIMETYPES = {"csv.gz": "application/gzip", "parquet": "application/vnd.apache.parquet"}
+
+
+def export_filename(name: str, fmt: str = EXPORT_FORMAT) -> str:
+    # other workspaces get their own Drive files
+    ws = db.current_workspace()
+    prefix = "" if ws == db.DEFAULT_WORKSPACE else f"{ws}_"
+    return f"{prefix}{name}.{fmt}"
+
+
+def legacy_filenames(name: str) -> tuple[str, ...]:
+    """Names older versions uploaded ``name`` under (plain ``<name>.csv``)."""
+    return (export_filename(name, "csv"),)
+
+
+def _iter_chunks(name: str, chunksize: int):
+    query, dtypes = EXPORTS[name]
+    # the Drive copy is overwritten in place, so it must include archived years
+    years = partitions.archived_years() if "{partitions}" in query else []
+    with get_engine().connect() as conn, partitions.attached_to(conn, years):
+        if "{partitions}" in query:
+            schemas = ["main"] + [partitions.schema_name(y) for y in years]
+            query = query.replace(
+                "{partitions}", " UNION ALL ".join(TX_PARTITION_SQL.format(schema=sch) for sch in schemas)
+            )
+        for chunk in pd.read_sql_query(text(query), conn, chunksize=chunksize):
+            yield chunk.astype(dtypes)
+
+
+def _write_csv_gz(chunks, fh):
+    with gzip.GzipFile(fileobj=fh, mode="wb") as gz:
+        out = io.TextIOWrapper(gz, encoding="utf-8", newline="")
+        for i, chunk in enumerate(chunks):
+            chunk.to_csv(out, index=False, header=(i == 0))
+        out.flush()
+        out.detach()
+
+
+def _write_parquet(chunks, fh):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise ImportError("Parquet exports require pyarrow (pip install pyarrow)") from e
+
+    writer = None
+    try:
+        for chunk in chunks:
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(fh, table.schema, compression="zstd")
+            writer.write_table(table)
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def write_export(name: str, fh, fmt: str = EXPORT_FORMAT, chunksize: int = CHUNK_ROWS):
+    """Stream export ``name`` from the database into binary file ``fh``."""
+    chunks = _iter_chunks(name, chunksize)
+    if fmt == "csv.gz":
+        _write_csv_gz(chunks, fh)
+    elif fmt == "parquet":
+        _write_parquet(chunks, fh)
+    else:
+        raise ValueError(f"Unknown export format: {fmt}")
+
+
+def export_to_drive(name: str, fmt: str = EXPORT_FORMAT, service=None, http=None) -> str:
+    """Export ``name`` and upload it to Drive, replacing any previous export.
+
+    Returns the Drive file ID.
+    """
+    with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES) as fh:
+        write_export(name, fh, fmt=fmt)
+        fh.seek(0)
+        return gdrive.upload_stream(
+            fh, export_filename(name, fmt), MIMETYPES[fmt], service=service, http=http
+        )
+
+
+def export_all_to_drive(
+    names: tuple[str, ...] = ("transactions", "categories", "rules"),
+    fmt: str = EXPORT_FORMAT,
+    max_workers: int = 3,
+) -> dict[str, str]:
+    """Upload several exports concurrently. Returns ``{name: file_id}``."""
+    service = gdrive._drive_service()
+
+    def run(name):
+        return export_to_drive(name, fmt=fmt, service=service, http=gdrive.thread_http())
+
+    # worker threads do not inherit the bound workspace, so run each in a copy of ours
+    ctx = copy_context()
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        return dict(zip(names, pool.map(lambda n: ctx.copy().run(run, n), names)))
@@ -3,7 +3,11 @@
 from __future__ import annotations
 
 import io
-from typing import Optional
+import json
+import threading
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Callable, Optional
 
 import pandas as pd
 from googleapiclient.discovery import build
@@ -16,60 +20,123 @@ from .gdrive_config import FOLDER_ID, TOKEN_FILE, CLIENT_SECRET
 
 SCOPES = ["https://www.googleapis.com/auth/drive.file"]
 
+# Refresh the access token this long before it actually expires so a request
+# never has to fail with 401 and retry.
+REFRESH_MARGIN = timedelta(minutes=5)
 
-def _drive_service():
-    creds = None
-    if os.path.exists(TOKEN_FILE):
+SYNC_STATE_PREFIX = "gdrive_sync:"
+
+# Resumable uploads are sent in pieces of this size (must be a multiple of
+# 256 KiB); an interrupted upload resumes from the last acknowledged piece.
+UPLOAD_CHUNK_SIZE = 4 * 1024 * 1024
+UPLOAD_RETRIES = 5
+
+_lock = threading.Lock()
+_creds: Optional[Credentials] = None
+_service = None
+_local = threading.local()
+
+
+def _save_token(creds: Credentials):
+    with open(TOKEN_FILE, "w") as token:
+        token.write(creds.to_json())
+
+
+def _needs_refresh(creds: Credentials) -> bool:
+    if not creds.valid:
+        return True
+    if creds.expiry is None:
+        return False
+    # google-auth stores expiry as naive UTC
+    return creds.expiry - datetime.utcnow() < REFRESH_MARGIN
+
+
+def _credentials() -> Credentials:
+    """Return process-wide credentials, refreshing them ahead of expiry."""
+    global _creds
+    creds = _creds
+    if creds is None and os.path.exists(TOKEN_FILE):
         creds = Credentials.from_authorized_user_file(TOKEN_FILE, SCOPES)
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            flow = InstalledAppFlow.from_client_secrets_file(CLIENT_SECRET, SCOPES)
-            creds = flow.run_local_server(port=0)
-        with open(TOKEN_FILE, "w") as token:
-            token.write(creds.to_json())
-    return build("drive", "v3", credentials=creds)
+    if creds is None or (_needs_refresh(creds) and not creds.refresh_token):
+        flow = InstalledAppFlow.from_client_secrets_file(CLIENT_SECRET, SCOPES)
+        creds = flow.run_local_server(port=0)
+        _save_token(creds)
+    elif _needs_refresh(creds):
+        creds.refresh(Request())
+        _save_token(creds)
+    _creds = creds
+    return creds
 
 
-def upload_df(df: pd.DataFrame, filename: str) -> Optional[str]:
-    """Upload a DataFrame as CSV to Google Drive.
+def _drive_service():
+    """Return the cached Drive client, building it on first use.
 
-    Returns the file ID if successful.
+    The client holds a reference to the shared credentials object, so a
+    refresh done here is picked up by the existing client without a rebuild.
     """
-    service = _drive_service()
-    file_metadata = {"name": filename}
-    if FOLDER_ID:
-        file_metadata["parents"] = [FOLDER_ID]
-    stream = io.BytesIO(df.to_csv(index=False).encode("utf-8"))
-    media = MediaIoBaseUpload(stream, mimetype="text/csv")
-    file = (
-        service.files()
-        .create(body=file_metadata, media_body=media, fields="id")
-        .execute()
-    )
-    return file.get("id")
+    global _service
+    with _lock:
+        _credentials()
+        if _service is None:
+            _service = build("drive", "v3", credentials=_creds, cache_discovery=False)
+        return _service
 
 
-def download_df(filename: str) -> Optional[pd.DataFrame]:
-    """Download a CSV from Google Drive into a DataFrame.
+def thread_http():
+    """Return an authorized HTTP transport owned by the calling thread.
 
-    Looks for a file with the given name inside the configured folder.
-    Returns ``None`` if the file is not found.
+    httplib2 connections are not thread-safe, so requests issued from worker
+    threads pass this as ``http=`` instead of using the client's own.
     """
-    service = _drive_service()
-    query = f"name='{filename}'"
+    import google_auth_httplib2
+    import httplib2
+
+    http = getattr(_local, "http", None)
+    if http is None:
+        with _lock:
+            creds = _credentials()
+        http = google_auth_httplib2.AuthorizedHttp(creds, http=httplib2.Http())
+        _local.http = http
+    return http
+
+
+def reset_drive_service():
+    """Drop the cached client and credentials (e.g. after changing accounts)."""
+    global _creds, _service
+    with _lock:
+        _creds = None
+        _service = None
+
+
+def _find_file(service, filename: str, http=None) -> Optional[dict]:
+    query = f"name='{filename}' and trashed=false"
     if FOLDER_ID:
         query += f" and '{FOLDER_ID}' in parents"
     results = (
         service.files()
-        .list(q=query, spaces="drive", fields="files(id,name)", pageSize=1)
-        .execute()
+        .list(
+            q=query,
+            spaces="drive",
+            fields="files(id,name,modifiedTime,md5Checksum)",
+            orderBy="modifiedTime desc",
+            pageSize=1,
+        )
+        .execute(http=http)
     )
     items = results.get("files", [])
-    if not items:
-        return None
-    file_id = items[0]["id"]
+    return items[0] if items else None
+
+
+def _read_frame(fh, filename: str) -> pd.DataFrame:
+    if filename.endswith(".parquet"):
+        return pd.read_parquet(fh)
+    if filename.endswith(".gz"):
+        return pd.read_csv(fh, compression="gzip")
+    return pd.read_csv(fh)
+
+
+def download_bytes(service, file_id: str) -> io.BytesIO:
+    """Fetch a file's content in chunks; the default ``download`` step."""
     request = service.files().get_media(fileId=file_id)
     fh = io.BytesIO()
     downloader = MediaIoBaseDownload(fh, request)
@@ -77,4 +144,128 @@ def download_df(filename: str) -> Optional[pd.DataFrame]:
     while not done:
         _, done = downloader.next_chunk()
     fh.seek(0)
-    return pd.read_csv(fh)
+    return fh
+
+
+def _download_file(service, file_id: str, filename: str, download=None) -> pd.DataFrame:
+    return _read_frame((download or download_bytes)(service, file_id), filename)
+
+
+def upload_stream(fh, filename: str, mimetype: str, service=None, http=None) -> str:
+    """Upload a binary file object to Drive with chunked resumable media.
+
+    If a file with this name already exists in the folder its content is
+    replaced in place, so repeated exports do not pile up duplicates.
+    Returns the file ID.
+    """
+    service = service or _drive_service()
+    media = MediaIoBaseUpload(
+        fh, mimetype=mimetype, chunksize=UPLOAD_CHUNK_SIZE, resumable=True
+    )
+    item = _find_file(service, filename, http=http)
+    if item:
+        request = service.files().update(
+            fileId=item["id"], media_body=media, fields="id"
+        )
+    else:
+        file_metadata = {"name": filename}
+        if FOLDER_ID:
+            file_metadata["parents"] = [FOLDER_ID]
+        request = service.files().create(
+            body=file_metadata, media_body=media, fields="id"
+        )
+    response = None
+    while response is None:
+        _, response = request.next_chunk(http=http, num_retries=UPLOAD_RETRIES)
+    return response["id"]
+
+
+def _find_first(service, filenames) -> tuple[Optional[dict], Optional[str]]:
+    """First of ``filenames`` present on Drive and its name."""
+    for name in filenames:
+        item = _find_file(service, name)
+        if item:
+            return item, name
+    return None, None
+
+
+def download_df(filename: str, service=None, fallbacks=(), download=None) -> Optional[pd.DataFrame]:
+    """Download a CSV/Parquet file from Google Drive into a DataFrame.
+
+    Looks for a file with the given name inside the configured folder, then
+    for each of ``fallbacks`` (e.g. legacy names). Returns ``None`` if none
+    is found. ``download(service, file_id)`` returns the content as a binary
+    file object and defaults to ``download_bytes``.
+    """
+    service = service or _drive_service()
+    item, name = _find_first(service, [filename, *fallbacks])
+    if not item:
+        return None
+    return _download_file(service, item["id"], name, download)
+
+
+def load_sync_state(filename: str) -> Optional[dict]:
+    from .db import get_session
+    from .models import Setting
+
+    with get_session() as s:
+        row = s.get(Setting, SYNC_STATE_PREFIX + filename)
+        return json.loads(row.value) if row else None
+
+
+def save_sync_state(filename: str, state: dict):
+    from .db import get_session
+    from .models import Setting
+
+    with get_session() as s:
+        s.merge(Setting(key=SYNC_STATE_PREFIX + filename, value=json.dumps(state)))
+
+
+@dataclass
+class SyncResult:
+    status: str  # 'missing' | 'unchanged' | 'downloaded'
+    df: Optional[pd.DataFrame] = None
+    remote: Optional[dict] = None  # id, modifiedTime, md5Checksum of the downloaded file
+    _save: Optional[Callable[[str, dict], None]] = field(default=None, repr=False)
+    _filename: Optional[str] = field(default=None, repr=False)
+
+    def commit(self):
+        """Record the downloaded version as synced; call once it was processed."""
+        if self.status == "downloaded" and self._save:
+            self._save(self._filename, self.remote)
+
+
+def _same_version(remote: dict, local: Optional[dict]) -> bool:
+    if not local or local.get("id") != remote.get("id"):
+        return False
+    if remote.get("md5Checksum") and local.get("md5Checksum"):
+        return remote["md5Checksum"] == local["md5Checksum"]
+    return remote.get("modifiedTime") == local.get("modifiedTime")
+
+
+def sync_df(filename: str, force: bool = False, service=None, state_store=None, fallbacks=(),
+            download=None) -> SyncResult:
+    """Download ``filename`` only if it changed since the last sync.
+
+    The remote ``md5Checksum``/``modifiedTime`` are compared with the state
+    saved by the previous sync; unchanged files are not downloaded at all.
+    The new version is only recorded once the caller has processed the
+    frame and calls ``result.commit()``. ``fallbacks`` are tried in order
+    when ``filename`` is missing. ``state_store`` is a ``(load, save)`` pair
+    and defaults to the settings table; ``download`` is as for
+    ``download_df``, so a fake service only needs ``files().list()``.
+    """
+    service = service or _drive_service()
+    load, save = state_store or (load_sync_state, save_sync_state)
+    item, filename = _find_first(service, [filename, *fallbacks])
+    if not item:
+        return SyncResult("missing")
+    if not force and _same_version(item, load(filename)):
+        return SyncResult("unchanged")
+    df = _download_file(service, item["id"], filename, download)
+    remote = {
+        "id": item["id"],
+        "modifiedTime": item.get("modifiedTime"),
+        "md5Checksum": item.get("md5Checksum"),
+    }
+    return SyncResult("downloaded", df, remote, save, filename)
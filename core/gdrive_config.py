@@ -9,3 +9,6 @@ CLIENT_SECRET = app_config.get("GDRIVE_CLIENT_SECRET", "gdrive_credentials.json"
 
 # Folder ID in Google Drive where CSV files are stored
 FOLDER_ID = app_config.get("GDRIVE_FOLDER_ID", "")
+
+# Format used for exports: "csv.gz" (default) or "parquet" (needs pyarrow)
+EXPORT_FORMAT = app_config.get("GDRIVE_EXPORT_FORMAT", "csv.gz")
@@ -0,0 +1,263 @@
+"""Bulk imports of categories and rules (Drive round-trips, spreadsheets)."""
+
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+
+import pandas as pd
+from sqlalchemy import insert, select, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from .db import get_session
+from .models import Category, Rule
+
+
+@dataclass
+class ImportSummary:
+    added: list = field(default_factory=list)
+    changed: list = field(default_factory=list)
+    unchanged: int = 0
+    skipped: int = 0
+
+    @property
+    def has_changes(self) -> bool:
+        return bool(self.added or self.changed)
+
+    def __str__(self):
+        return (
+            f"added {len(self.added)}, changed {len(self.changed)}, "
+            f"unchanged {self.unchanged}, skipped {self.skipped}"
+        )
+
+
+def _clean(value):
+    if value is None:
+        return None
+    try:
+        if pd.isna(value):
+            return None
+    except (TypeError, ValueError):
+        pass
+    return value
+
+
+def _as_bool(value, default=True) -> bool:
+    value = _clean(value)
+    if value is None:
+        return default
+    if isinstance(value, str):
+        return value.strip().lower() in ("true", "1", "yes", "y")
+    return bool(value)
+
+
+def _as_float(value):
+    value = _clean(value)
+    return None if value is None else float(value)
+
+
+def _as_str(value):
+    value = _clean(value)
+    return None if value is None else str(value)
+
+
+def import_categories(df: pd.DataFrame) -> ImportSummary:
+    """Merge a categories frame (``name``, ``description``, ``active``) by name.
+
+    Existing categories are loaded with one query; inserts and updates are
+    sent as bulk statements.
+    """
+    summary = ImportSummary()
+    incoming = {}
+    for rec in df.to_dict("records"):
+        name = str(_clean(rec.get("name")) or "").strip()
+        if not name:
+            summary.skipped += 1
+            continue
+        incoming[name] = {
+            "description": _as_str(rec.get("description")),
+            "is_active": _as_bool(rec.get("active")),
+        }
+
+    with get_session() as s:
+        existing = {
+            name: (cid, desc, active)
+            for cid, name, desc, active in s.execute(
+                select(Category.id, Category.name, Category.description, Category.is_active)
+            )
+        }
+        inserts, updates = [], []
+        for name, values in incoming.items():
+            if name not in existing:
+                inserts.append({"name": name, **values})
+                summary.added.append(name)
+                continue
+            cid, desc, active = existing[name]
+            if (desc, bool(active)) == (values["description"], values["is_active"]):
+                summary.unchanged += 1
+            else:
+                updates.append({"id": cid, **values})
+                summary.changed.append(name)
+        if inserts:
+            s.execute(insert(Category), inserts)
+        if updates:
+            s.execute(update(Category), updates)
+    return summary
+
+
+RULE_FIELDS = ("category_id", "field", "match_type", "pattern", "amount_min", "amount_max", "enabled")
+
+
+def import_rules(df: pd.DataFrame) -> ImportSummary:
+    """Merge a rules frame keyed by ``id``.
+
+    Rows whose id exists are updated if any field differs; rows with an
+    unknown id keep it, rows without an id get a new one unless an identical
+    rule (category, field, match type, pattern) already exists. Rows that
+    would give a rule the same key as another rule are skipped.
+    ``category_id`` may be missing if ``category`` names an existing category.
+    """
+    summary = ImportSummary()
+    with get_session() as s:
+        cat_ids = {name: cid for cid, name in s.execute(select(Category.id, Category.name))}
+        existing = {
+            row.id: tuple(getattr(row, f) for f in RULE_FIELDS)
+            for row in s.execute(select(Rule.id, *(getattr(Rule, f) for f in RULE_FIELDS)))
+        }
+        # rule key -> id of the rule holding it (None for rows added without an id)
+        owners = {v[:4]: rid for rid, v in existing.items()}
+        inserts, updates = [], []
+        for rec in df.to_dict("records"):
+            category_id = _clean(rec.get("category_id"))
+            if category_id is None:
+                category_id = cat_ids.get(_as_str(rec.get("category")))
+            pattern = _as_str(rec.get("pattern"))
+            if category_id is None or not pattern:
+                summary.skipped += 1
+                continue
+            values = {
+                "category_id": int(category_id),
+                "field": _as_str(rec.get("field")) or "counterparty",
+                "match_type": _as_str(rec.get("type")) or "contains",
+                "pattern": pattern,
+                "amount_min": _as_float(rec.get("amount_min")),
+                "amount_max": _as_float(rec.get("amount_max")),
+                "enabled": _as_bool(rec.get("enabled")),
+            }
+            rid = _clean(rec.get("id"))
+            rid = None if rid is None else int(rid)
+            key = tuple(values[f] for f in RULE_FIELDS[:4])
+            if rid is None and key in owners:
+                summary.unchanged += 1
+                continue
+            if key in owners and owners[key] != rid:
+                # another rule already has this key (ux_rules_key)
+                summary.skipped += 1
+                continue
+            if rid is None or rid not in existing:
+                owners[key] = rid
+                if rid is not None:
+                    values["id"] = rid
+                    existing[rid] = tuple(values[f] for f in RULE_FIELDS)
+                inserts.append(values)
+                continue
+            current = existing[rid]
+            if tuple(values[f] for f in RULE_FIELDS) == (*current[:-1], bool(current[-1])):
+                summary.unchanged += 1
+            else:
+                owners.pop(current[:4], None)
+                owners[key] = rid
+                updates.append({"id": rid, **values})
+                summary.changed.append(rid)
+        # rows with and without explicit ids need separate executemany batches;
+        # RETURNING reports only the rows that were actually written
+        for batch in ([v for v in inserts if "id" in v], [v for v in inserts if "id" not in v]):
+            if batch:
+                written = s.scalars(
+                    sqlite_insert(Rule).on_conflict_do_nothing().returning(Rule.id), batch
+                ).all()
+                summary.added.extend(written)
+                summary.skipped += len(batch) - len(written)
+        if updates:
+            s.execute(update(Rule), updates)
+    return summary
+
+
+SEED_REQUIRED_COLS = ["Categories", "Description", "Providers"]
+
+
+def _iter_xlsx_records(file):
+    """Yield rows of the first sheet as dicts keyed by the header row."""
+    from openpyxl import load_workbook
+
+    wb = load_workbook(file, read_only=True, data_only=True)
+    try:
+        rows = wb.worksheets[0].iter_rows(values_only=True)
+        header = [str(h).strip() if h is not None else "" for h in next(rows, ())]
+        missing = [c for c in SEED_REQUIRED_COLS if c not in header]
+        if missing:
+            raise ValueError(f"Missing required columns in Excel: {missing}. Found: {header}")
+        for row in rows:
+            yield dict(zip(header, row))
+    finally:
+        wb.close()
+
+
+def _cell_str(value):
+    if value is None:
+        return None
+    return str(value).strip() or None
+
+
+def seed_from_categories_xlsx(file) -> tuple[int, int]:
+    """Create categories and 'contains' counterparty rules from Categories.xlsx.
+
+    Expected columns: Categories, Description, Providers (comma separated),
+    optionally Additional comment. The workbook is streamed in read-only
+    mode; existing categories and rule keys are preloaded into sets so only
+    new rows are inserted. Returns ``(added_categories, added_rules)``.
+    """
+    new_cats = {}
+    providers_by_cat = {}
+    for rec in _iter_xlsx_records(file):
+        name = _cell_str(rec.get("Categories"))
+        if not name:
+            continue
+        new_cats.setdefault(name, {
+            "name": name,
+            "description": _cell_str(rec.get("Description")),
+            "comment": _cell_str(rec.get("Additional comment")),
+            "is_active": True,
+        })
+        providers = _cell_str(rec.get("Providers")) or ""
+        providers_by_cat.setdefault(name, []).extend(
+            p.strip() for p in providers.split(",") if p.strip()
+        )
+
+    with get_session() as s:
+        cat_ids = {name: cid for cid, name in s.execute(select(Category.id, Category.name))}
+        cat_rows = [v for k, v in new_cats.items() if k not in cat_ids]
+        if cat_rows:
+            s.execute(insert(Category), cat_rows)
+            cat_ids = {name: cid for cid, name in s.execute(select(Category.id, Category.name))}
+
+        keys = set(s.execute(
+            select(Rule.category_id, Rule.pattern).where(
+                Rule.field == "counterparty", Rule.match_type == "contains"
+            )
+        ).tuples())
+        rule_rows = []
+        for name, providers in providers_by_cat.items():
+            cid = cat_ids[name]
+            for p in providers:
+                if (cid, p) in keys:
+                    continue
+                keys.add((cid, p))
+                rule_rows.append({
+                    "category_id": cid,
+                    "field": "counterparty",
+                    "match_type": "contains",
+                    "pattern": p,
+                })
+        if rule_rows:
+            s.execute(sqlite_insert(Rule).on_conflict_do_nothing(), rule_rows)
+    return len(cat_rows), len(rule_rows)
@@ -1,8 +1,9 @@
 from __future__ import annotations
 import pandas as pd
 from dateutil import parser as dparser
-from sqlalchemy import select
+from sqlalchemy import select, func
 from typing import Tuple
+from . import partitions
 from .db import get_session
 from .models import Transaction, IngestionBatch
 from .utils_text import normalize_text, stable_hash
@@ -46,12 +47,18 @@ def ingest_csv(file, batch_name: str) -> Tuple[int, int]:
         existing_hashes = set(h for (h,) in s.execute(
             select(Transaction.ext_hash)
         ).all())
+        # closed years may already live in read-only archives
+        years = sorted({d.year for d in df['completed_at']})
+        existing_hashes |= partitions.archived_hashes(years)
+        # ids stay unique across the hot db and its archives
+        next_id = max(s.scalar(select(func.max(Transaction.id))) or 0, partitions.archived_max_id()) + 1
 
         for _, r in df.iterrows():
             if r['ext_hash'] in existing_hashes:
                 rows_skipped += 1
                 continue
             tx = Transaction(
+                id=next_id,
                 ext_hash=r['ext_hash'],
                 completed_at=r['completed_at'],
                 counterparty=str(r['Counterparty name']),
@@ -61,6 +68,8 @@ def ingest_csv(file, batch_name: str) -> Tuple[int, int]:
                 ingest_batch_id=batch.id,
             )
             s.add(tx)
+            existing_hashes.add(r['ext_hash'])
+            next_id += 1
             rows_ingested += 1
 
         batch.rows_ingested = rows_ingested
@@ -1,5 +1,5 @@
 from sqlalchemy.orm import Mapped, mapped_column, relationship
-from sqlalchemy import String, Integer, DateTime, Float, Boolean, ForeignKey, Text, UniqueConstraint, func
+from sqlalchemy import String, Integer, DateTime, Float, Boolean, ForeignKey, Text, UniqueConstraint, Index, func
 from datetime import datetime
 from .db import Base
 
@@ -29,6 +29,9 @@ class Category(Base):
 
 class Rule(Base):
     __tablename__ = "rules"
+    __table_args__ = (
+        Index("ux_rules_key", "category_id", "field", "match_type", "pattern", unique=True),
+    )
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     category_id: Mapped[int] = mapped_column(ForeignKey("categories.id"))
     field: Mapped[str] = mapped_column(String(20))  # 'counterparty' | 'reference'
@@ -49,8 +52,9 @@ class Assignment(Base):
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     transaction_id: Mapped[int] = mapped_column(ForeignKey("transactions.id"), unique=True)
     category_id: Mapped[int] = mapped_column(ForeignKey("categories.id"))
-    source: Mapped[str] = mapped_column(String(20))  # 'rule' | 'manual'
+    source: Mapped[str] = mapped_column(String(20))  # 'rule' | 'manual' | 'model'
     rule_id: Mapped[int | None] = mapped_column(ForeignKey("rules.id"), nullable=True)
+    confidence: Mapped[float | None] = mapped_column(Float, nullable=True)  # model suggestions only
     assigned_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
 
     transaction: Mapped["Transaction"] = relationship(back_populates="assignment")
@@ -69,3 +73,13 @@ class Setting(Base):
     __tablename__ = "settings"
     key: Mapped[str] = mapped_column(String(100), primary_key=True)
     value: Mapped[str] = mapped_column(Text)
+
+class ChangeLog(Base):
+    """Append-only change journal, written by SQLite triggers (see core.changes)."""
+    __tablename__ = "change_log"
+    __table_args__ = {"sqlite_autoincrement": True}  # never reuse sequence numbers
+    seq: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    table_name: Mapped[str] = mapped_column(String(40))
+    row_id: Mapped[int] = mapped_column(Integer)
+    op: Mapped[str] = mapped_column(String(1))  # 'I' | 'U' | 'D'
+    changed_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.current_timestamp())
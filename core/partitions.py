@@ -0,0 +1,200 @@
+"""Year-partitioned, read-only archives of closed years.
+
+``archive_year`` moves one closed year's transactions and assignments out
+of the hot database into ``data/archive/<db>_<year>.db``, compacts that file
+and marks it read-only. Queries attach an archive only when the requested
+date range reaches into it (see ``core.queries``); rules, manual edits and
+the FTS index only ever touch the hot database.
+"""
+
+from __future__ import annotations
+
+import os
+import re
+import sqlite3
+import stat
+from contextlib import contextmanager
+from datetime import date, datetime
+from functools import lru_cache
+from pathlib import Path
+
+from sqlalchemy import MetaData, create_engine, func, select
+from sqlalchemy.orm import aliased
+
+from . import db
+from .db import get_session
+from .models import Assignment, Setting, Transaction
+
+ARCHIVE_MAX_ID_KEY = "archive_max_tx_id"
+TX_COLUMNS = [c.name for c in Transaction.__table__.columns]
+ASSIGNMENT_COLUMNS = [c.name for c in Assignment.__table__.columns]
+
+
+def archive_dir() -> Path:
+    return db.db_path().parent / "archive"
+
+
+def partition_path(year: int) -> Path:
+    return archive_dir() / f"{db.db_path().stem}_{year}.db"
+
+
+def archived_years() -> list[int]:
+    d = archive_dir()
+    if not d.exists():
+        return []
+    pat = re.compile(rf"^{re.escape(db.db_path().stem)}_(\d{{4}})\.db$")
+    return sorted(int(m.group(1)) for p in d.iterdir() if (m := pat.match(p.name)))
+
+
+def years_in_range(date_from: date | None, date_to: date | None) -> list[int]:
+    """Archived years a date range reaches into. ``None`` bounds are open."""
+    return [
+        y for y in archived_years()
+        if (date_from is None or y >= date_from.year) and (date_to is None or y <= date_to.year)
+    ]
+
+
+def schema_name(year: int) -> str:
+    return f"archive_{year}"
+
+
+@lru_cache(maxsize=None)
+def entities(year: int):
+    """ORM ``(Transaction, Assignment)`` aliases bound to an attached archive."""
+    md = MetaData()
+    schema = schema_name(year)
+    tx = Transaction.__table__.to_metadata(md, schema=schema)
+    asg = Assignment.__table__.to_metadata(md, schema=schema)
+    return aliased(Transaction, tx, adapt_on_names=True), aliased(Assignment, asg, adapt_on_names=True)
+
+
+@contextmanager
+def attached(session, years: list[int]):
+    """ATTACH the given archives to ``session``'s connection for the block.
+
+    Yields that connection; the session keeps it until the block ends.
+    Archives are only read, and DETACH runs on the same connection.
+    """
+    with attached_to(session.connection(), years) as conn:
+        yield conn
+
+
+@contextmanager
+def attached_to(conn, years: list[int]):
+    """Like ``attached`` for a plain SQLAlchemy ``Connection``."""
+    present = {row[1] for row in conn.exec_driver_sql("PRAGMA database_list")}
+    added = []
+    try:
+        for y in years:
+            if schema_name(y) not in present:
+                conn.exec_driver_sql(f"ATTACH DATABASE ? AS {schema_name(y)}", (str(partition_path(y)),))
+                added.append(y)
+        yield conn
+    finally:
+        if added:
+            # DETACH is refused inside an open transaction; end it on this
+            # connection (a session.commit() would hand it back to the pool)
+            dbapi = conn.connection.driver_connection
+            if dbapi.in_transaction:
+                dbapi.commit()
+            for y in added:
+                conn.exec_driver_sql(f"DETACH DATABASE {schema_name(y)}")
+
+
+def archived_hashes(years) -> set[str]:
+    """ext_hash values stored in the given archives (for ingestion dedup)."""
+    hashes = set()
+    for y in years:
+        if y not in archived_years():
+            continue
+        con = sqlite3.connect(f"file:{partition_path(y)}?mode=ro", uri=True)
+        try:
+            hashes.update(h for (h,) in con.execute("SELECT ext_hash FROM transactions"))
+        finally:
+            con.close()
+    return hashes
+
+
+def archived_max_id() -> int:
+    with get_session() as s:
+        row = s.get(Setting, ARCHIVE_MAX_ID_KEY)
+        return int(row.value) if row else 0
+
+
+def hot_years() -> list[int]:
+    with get_session() as s:
+        years = s.scalars(
+            select(func.strftime('%Y', Transaction.completed_at)).distinct()
+        ).all()
+    return sorted(int(y) for y in years if y)
+
+
+def archive_year(year: int, vacuum_hot: bool = True) -> int:
+    """Move a closed year into its read-only archive file. Returns rows moved.
+
+    Running it again for an already archived year appends transactions that
+    were ingested into the hot database since.
+    """
+    if year >= datetime.now().year:
+        raise ValueError(f"{year} is not a closed year")
+    db.ensure_db()
+    path = partition_path(year)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if path.exists():
+        os.chmod(path, stat.S_IRUSR | stat.S_IWUSR | stat.S_IRGRP | stat.S_IROTH)
+    else:
+        engine = create_engine(f"sqlite:///{path}")
+        db.Base.metadata.create_all(engine, tables=[Transaction.__table__, Assignment.__table__])
+        engine.dispose()
+    try:
+        moved = _move_year(path, year, vacuum_hot)
+        arch = sqlite3.connect(path)
+        try:
+            arch.execute("PRAGMA journal_mode=DELETE")
+            arch.execute("VACUUM")
+        finally:
+            arch.close()
+    finally:
+        os.chmod(path, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+    return moved
+
+
+def _move_year(path: Path, year: int, vacuum_hot: bool) -> int:
+    start, end = f"{year:04d}-01-01", f"{year + 1:04d}-01-01"
+    tx_cols = ", ".join(TX_COLUMNS)
+    # the hot table reuses assignment ids once rows are moved out, so the
+    # archive numbers its own; rows are keyed by transaction_id anyway
+    asg_cols = ", ".join(c for c in ASSIGNMENT_COLUMNS if c != "id")
+    con = sqlite3.connect(db.db_path(), timeout=30)
+    try:
+        con.execute("ATTACH DATABASE ? AS arch", (str(path),))
+        with con:
+            con.execute(
+                f"CREATE TEMP TABLE moving AS SELECT id FROM main.transactions "
+                f"WHERE completed_at >= ? AND completed_at < ?", (start, end)
+            )
+            moved = con.execute("SELECT COUNT(*) FROM moving").fetchone()[0]
+            con.execute(
+                f"INSERT INTO arch.transactions ({tx_cols}) SELECT {tx_cols} FROM main.transactions "
+                f"WHERE id IN (SELECT id FROM moving)"
+            )
+            con.execute(
+                f"INSERT INTO arch.assignments ({asg_cols}) SELECT {asg_cols} FROM main.assignments "
+                f"WHERE transaction_id IN (SELECT id FROM moving)"
+            )
+            max_id = con.execute("SELECT MAX(id) FROM moving").fetchone()[0] or 0
+            con.execute("DELETE FROM main.assignments WHERE transaction_id IN (SELECT id FROM moving)")
+            con.execute("DELETE FROM main.transactions WHERE id IN (SELECT id FROM moving)")
+            con.execute("DROP TABLE moving")
+            # keep transaction ids unique across partitions (see ingest_csv)
+            con.execute(
+                "INSERT INTO main.settings (key, value) VALUES (?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = MAX(CAST(value AS INTEGER), CAST(excluded.value AS INTEGER))",
+                (ARCHIVE_MAX_ID_KEY, max_id),
+            )
+        con.execute("DETACH DATABASE arch")
+        if vacuum_hot and moved:
+            con.execute("VACUUM")
+    finally:
+        con.close()
+    return moved
@@ -1,41 +1,146 @@
-from sqlalchemy import select, func, case, and_
+from datetime import datetime, time, timedelta
+from sqlalchemy import select, func, case, and_, or_, table, column, true
+from sqlalchemy.orm import Session
+from . import db, partitions
 from .db import get_session
 from .models import Transaction, Assignment, Category
 
-def monthly_expense_by_category(category_ids: list[int] | None = None, include_income=False):
-    # Sum abs(amount) for expenses; optionally include income
-    with get_session() as s:
-        amt = func.abs(Transaction.amount)
-        month = func.strftime('%Y-%m', Transaction.completed_at).label('month')
-        join = s.query(
-            month,
-            Category.name.label('category'),
-            func.sum(amt).label('total')
-        ).select_from(Transaction).join(Assignment, Assignment.transaction_id == Transaction.id, isouter=True)         .join(Category, Category.id == Assignment.category_id, isouter=True)
-
-        conds = []
-        if not include_income:
-            conds.append(Transaction.is_income == False)  # noqa
-        if category_ids:
-            conds.append(Category.id.in_(category_ids))
-        if conds:
-            join = join.filter(and_(*conds))
-
-        join = join.group_by(month, Category.name).order_by(month.asc(), Category.name.asc())
-        rows = join.all()
-        return rows
+transactions_fts = table("transactions_fts", column("rowid"), column("rank"), column("transactions_fts"))
+
+def _fts_phrase(text: str) -> str:
+    # Quote the whole input so it is matched as one substring, not FTS syntax
+    return '"' + text.replace('"', '""') + '"'
+
+def _uses_fts(text: str) -> bool:
+    # the trigram tokenizer can only look up strings of 3+ characters
+    return db.fts_enabled() and len(text) >= 3
+
+def text_condition(text: str, T=Transaction, fts: bool = True):
+    """Case-insensitive substring match on counterparty or reference."""
+    if fts and _uses_fts(text):
+        return T.id.in_(
+            select(transactions_fts.c.rowid).where(
+                transactions_fts.c.transactions_fts.op("MATCH")(_fts_phrase(text))
+            )
+        )
+    return or_(
+        T.counterparty.icontains(text, autoescape=True),
+        T.reference.icontains(text, autoescape=True),
+    )
+
+def _archive_years(filters: dict | None) -> list[int]:
+    """Archived years reached by the filter's date range (none without a range)."""
+    f = filters or {}
+    if not f.get('date_from') and not f.get('date_to'):
+        return []
+    return partitions.years_in_range(f.get('date_from'), f.get('date_to'))
+
+def _each_partition(s, years):
+    """Yield ``(session, Transaction, Assignment, is_hot)`` for the hot DB and each attached archive.
+
+    Archives get their own session on the shared connection: assignment ids
+    are only unique within a partition, so the identity maps must not mix.
+    """
+    yield s, Transaction, Assignment, True
+    if years:
+        with partitions.attached(s, years) as conn:
+            for y in years:
+                T, A = partitions.entities(y)
+                with Session(bind=conn, expire_on_commit=False) as arch:
+                    yield arch, T, A, False
+
+def transaction_filter_conditions(filters: dict | None = None, T=Transaction, A=Assignment,
+                                  fts: bool = True) -> list:
+    """Translate a transaction browser filter dict into SQL conditions.
+
+    Supported keys: ``uncategorized``, ``category_id``, ``income``,
+    ``date_from``/``date_to`` (inclusive dates), ``text`` (substring of
+    counterparty or reference), ``amount_min``/``amount_max``. Conditions on
+    the assignment assume an outer join to ``Assignment``. ``T``/``A`` may be
+    archive aliases from ``core.partitions``; those have no FTS index.
+    """
+    f = filters or {}
+    conds = []
+    if f.get('uncategorized'):
+        # model suggestions are not accepted categories yet
+        conds.append(or_(A.id.is_(None), A.source == 'model'))
+    if f.get('category_id'):
+        conds.append(A.category_id == f['category_id'])
+    if 'income' in f:
+        conds.append(T.is_income == bool(f['income']))
+    if f.get('date_from'):
+        conds.append(T.completed_at >= datetime.combine(f['date_from'], time.min))
+    if f.get('date_to'):
+        conds.append(T.completed_at < datetime.combine(f['date_to'] + timedelta(days=1), time.min))
+    if f.get('text'):
+        conds.append(text_condition(f['text'], T, fts=fts and T is Transaction))
+    if f.get('amount_min') is not None:
+        conds.append(T.amount >= f['amount_min'])
+    if f.get('amount_max') is not None:
+        conds.append(T.amount <= f['amount_max'])
+    return conds
 
 def fetch_transactions(filters: dict | None = None):
+    """Transactions matching ``filters``, newest first.
+
+    Archived years are included only when the date range reaches into them.
+    """
+    rows = []
+    with get_session() as s:
+        for ps, T, A, _ in _each_partition(s, _archive_years(filters)):
+            q = ps.query(T, A, Category).select_from(T) \
+                .join(A, A.transaction_id == T.id, isouter=True) \
+                .join(Category, Category.id == A.category_id, isouter=True) \
+                .order_by(T.completed_at.desc())
+            conds = transaction_filter_conditions(filters, T, A)
+            if conds:
+                q = q.filter(and_(*conds))
+            rows += q.all()
+    if len(rows) > 1:
+        rows.sort(key=lambda r: r[0].completed_at, reverse=True)
+    return rows
+
+def search_transactions(text: str, filters: dict | None = None, limit: int = 100, offset: int = 0):
+    """Ranked, paginated substring search over counterparty and reference.
+
+    Uses the FTS5 trigram index (best bm25 rank first) when available,
+    otherwise a LIKE scan ordered by date. ``filters`` takes the same keys as
+    ``fetch_transactions`` (its ``text`` key is ignored); archived years the
+    date range reaches are scanned with LIKE and ranked after the hot
+    matches. Returns ``(rows, total)`` where ``rows`` are
+    ``(Transaction, Assignment, Category)``.
+    """
+    rest = {k: v for k, v in (filters or {}).items() if k != 'text'}
+    rows, total = [], 0
+    with get_session() as s:
+        for ps, T, A, hot in _each_partition(s, _archive_years(rest)):
+            q = ps.query(T, A, Category).select_from(T)
+            if hot and _uses_fts(text):
+                q = q.join(transactions_fts, transactions_fts.c.rowid == T.id).filter(
+                    transactions_fts.c.transactions_fts.op("MATCH")(_fts_phrase(text))
+                )
+                order = (transactions_fts.c.rank, T.completed_at.desc())
+            else:
+                q = q.filter(text_condition(text, T, fts=False))
+                order = (T.completed_at.desc(),)
+            q = q.join(A, A.transaction_id == T.id, isouter=True) \
+                .join(Category, Category.id == A.category_id, isouter=True)
+            conds = transaction_filter_conditions(rest, T, A)
+            if conds:
+                q = q.filter(and_(*conds))
+            total += q.with_entities(func.count()).scalar()
+            rows += q.order_by(*order).limit(offset + limit).all()
+        return rows[offset:offset + limit], total
+
+def count_hot_transactions(filters: dict | None = None) -> int:
+    """Matches in the hot database only, i.e. the rows bulk edits can change."""
     with get_session() as s:
-        q = s.query(Transaction, Assignment, Category)             .join(Assignment, Assignment.transaction_id == Transaction.id, isouter=True)             .join(Category, Category.id == Assignment.category_id, isouter=True)             .order_by(Transaction.completed_at.desc())
-        f = filters or {}
-        if 'uncategorized' in f and f['uncategorized']:
-            q = q.filter(Assignment.id.is_(None))
-        if 'category_id' in f and f['category_id']:
-            q = q.filter(Category.id == f['category_id'])
-        if 'income' in f:
-            q = q.filter(Transaction.is_income == bool(f['income']))
-        return q.all()
+        return s.scalar(
+            select(func.count(Transaction.id))
+            .select_from(Transaction)
+            .join(Assignment, Assignment.transaction_id == Transaction.id, isouter=True)
+            .where(true(), *transaction_filter_conditions(filters))
+        ) or 0
 
 def categories_list(active_only=True):
     with get_session() as s:
@@ -1,9 +1,13 @@
 from __future__ import annotations
 import re
+from dataclasses import dataclass, field
+from functools import lru_cache
 from typing import Optional, Iterable
-from sqlalchemy import select
-from rapidfuzz import fuzz
+from sqlalchemy import select, update, delete, func
+from rapidfuzz import fuzz, process
 from .models import Rule, Transaction, Assignment
+from . import db
+from .changes import latest_seq
 from .db import get_session
 from .utils_text import normalize_text
 
@@ -55,11 +59,12 @@ def apply_rules_to_uncategorized():
     with get_session() as s:
         rules = s.scalars(select(Rule)).all()
         txs = s.scalars(select(Transaction)).all()
-        # build map of tx id -> has assignment
-        assigned = {a.transaction_id for a in s.scalars(select(Assignment)).all()}
+        # build map of tx id -> assignment; model suggestions may be overridden
+        assigned = {a.transaction_id: a for a in s.scalars(select(Assignment)).all()}
         changed = 0
         for tx in txs:
-            if tx.id in assigned:
+            a = assigned.get(tx.id)
+            if a is not None and a.source != 'model':
                 continue
             if tx.is_income:
                 # skip auto-categorizing income; treat separately
@@ -67,13 +72,20 @@ def apply_rules_to_uncategorized():
             result = choose_category_for(tx, rules)
             if result:
                 cat_id, rule_id = result
-                a = Assignment(transaction_id=tx.id, category_id=cat_id, source='rule', rule_id=rule_id)
-                s.add(a)
+                if a is not None:
+                    a.category_id = cat_id
+                    a.source = 'rule'
+                    a.rule_id = rule_id
+                    a.confidence = None
+                else:
+                    a = Assignment(transaction_id=tx.id, category_id=cat_id, source='rule', rule_id=rule_id)
+                    s.add(a)
                 changed += 1
     return True
 
 
-def apply_rules_to_all():
+def apply_rules_to_all(keep_manual: bool = False):
+    """Re-run every rule over all expenses; ``keep_manual`` leaves manual assignments alone."""
     with get_session() as s:
         rules = s.scalars(select(Rule)).all()
         txs = s.scalars(select(Transaction)).all()
@@ -85,10 +97,13 @@ def apply_rules_to_all():
             if result:
                 cat_id, rule_id = result
                 a = s.scalar(select(Assignment).where(Assignment.transaction_id == tx.id))
+                if a and keep_manual and a.source == 'manual':
+                    continue
                 if a:
                     a.category_id = cat_id
                     a.source = 'rule'
                     a.rule_id = rule_id
+                    a.confidence = None
                 else:
                     s.add(
                         Assignment(
@@ -125,6 +140,7 @@ def apply_rule_to_all_transactions(rule_id: int):
                     a.category_id = rule.category_id
                     a.source = 'rule'
                     a.rule_id = rule.id
+                    a.confidence = None
                 else:
                     s.add(
                         Assignment(
@@ -136,3 +152,501 @@ def apply_rule_to_all_transactions(rule_id: int):
                     )
                 count += 1
         return count
+
+
+MATCH_ORDER = {'exact': 0, 'contains': 1, 'regex': 2, 'fuzzy': 3}
+
+
+def rule_key_conflicts() -> list[list[int]]:
+    """Groups of rule ids sharing (category, field, match type, pattern).
+
+    Older databases can hold such rules with different amount ranges or case
+    settings; the unique rule index is only created once none are left.
+    """
+    with get_session() as s:
+        rows = s.execute(
+            select(func.group_concat(Rule.id))
+            .group_by(Rule.category_id, Rule.field, Rule.match_type, Rule.pattern)
+            .having(func.count(Rule.id) > 1)
+        ).scalars().all()
+    return [sorted(int(i) for i in ids.split(",")) for ids in rows]
+
+def _compile_matcher(rule: Rule):
+    """Return ``value -> bool`` equivalent to ``match_rule(rule, value)``."""
+    if rule.match_type in ('exact', 'contains', 'fuzzy'):
+        pat = rule.pattern if rule.case_sensitive else rule.pattern.lower()
+        lower = not rule.case_sensitive
+        if rule.match_type == 'exact':
+            return lambda v: (v.lower() if lower else v) == pat
+        if rule.match_type == 'contains':
+            return lambda v: pat in (v.lower() if lower else v)
+        return lambda v: fuzz.ratio(v.lower() if lower else v, pat) >= 90
+    if rule.match_type == 'regex':
+        try:
+            rx = re.compile(rule.pattern, 0 if rule.case_sensitive else re.IGNORECASE)
+        except re.error:
+            return lambda v: False
+        return lambda v: rx.search(v) is not None
+    return lambda v: False
+
+
+@dataclass
+class RuleImpact:
+    """What a rule does to the current (non-income) transactions."""
+    rule_id: int | None
+    category_id: int
+    matches: int = 0  # transactions the rule matches on its own
+    wins: int = 0  # transactions it categorizes after precedence
+    new: int = 0  # wins on transactions no rule categorized before
+    taken: dict = field(default_factory=dict)  # category_id -> wins taken from it
+    shadowed_by: dict = field(default_factory=dict)  # category_id -> matches lost to it
+
+    @property
+    def shadowed(self) -> int:
+        return self.matches - self.wins
+
+
+@dataclass
+class ImpactReport:
+    rules: list  # RuleImpact per enabled rule in the scenario, precedence order
+    candidate: Optional[RuleImpact]
+    changed: int  # transactions whose rule category would change
+    categorized_before: int
+    categorized_after: int
+    # rules evaluated by choose_category_for summed over all transactions
+    evaluations_before: int = 0
+    evaluations_after: int = 0
+    # baseline winners of the transactions that would change category
+    displaced_rule_ids: set = field(default_factory=set)
+
+
+def _load_tx_values():
+    """Distinct normalized (counterparty, reference) pairs with their amounts."""
+    with get_session() as s:
+        rows = s.execute(
+            select(Transaction.counterparty, Transaction.reference, Transaction.amount)
+            .where(Transaction.is_income == False)  # noqa
+        ).all()
+    normalize = lru_cache(maxsize=None)(normalize_text)
+    groups: dict[tuple[str, str], list[float]] = {}
+    for cp, ref, amount in rows:
+        groups.setdefault((normalize(cp), normalize(ref)), []).append(amount)
+    return groups
+
+
+def _in_range(rule: Rule, amount: float) -> bool:
+    if rule.amount_min is not None and amount < rule.amount_min:
+        return False
+    if rule.amount_max is not None and amount > rule.amount_max:
+        return False
+    return True
+
+
+def _winner(matched, amount, members):
+    for r in matched:
+        if id(r) in members and _in_range(r, amount):
+            return r
+    return None
+
+
+def _category(rule):
+    return rule.category_id if rule is not None else None
+
+
+_BACKREF = re.compile(r"\\[1-9]|\(\?P=")
+_LEADING_LITERAL = re.compile(r"[a-z0-9 ]{3,}", re.IGNORECASE)
+
+
+def _regex_literal(pattern: str) -> str:
+    """Lowercased text every match of ``pattern`` must contain, if it starts with one.
+
+    Values are normalized to lowercase ASCII, so a plain substring test on
+    them agrees with the case-insensitive regex.
+    """
+    m = _LEADING_LITERAL.match(pattern)
+    if m is None or '|' in pattern:
+        return ''
+    lit = m.group()
+    if pattern[m.end():m.end() + 1] in ('?', '*', '{'):
+        lit = lit[:-1]  # the quantifier makes the last character optional
+    return lit.lower() if len(lit) >= 3 else ''
+
+
+class _FieldIndex:
+    """Rules on one field, indexed for matching many distinct values.
+
+    Case-insensitive exact rules are a dict lookup, contains rules (and
+    regexes starting with literal text) are found through one of their
+    trigrams, fuzzy rules go through rapidfuzz in one call and the remaining
+    regexes are skipped at once when a combined pattern does not match.
+    Values are expected normalized; results are cached per value.
+    """
+
+    def __init__(self):
+        self.exact: dict[str, list] = {}
+        self.grams: dict[str, list] = {}  # trigram -> [(rule, literal, regex or None)]
+        self.short: list = []  # contains patterns shorter than a trigram
+        self.fuzzy: list = []  # (rule, pattern)
+        self.regex: list = []  # (rule, compiled), case-insensitive
+        self.other: list = []  # (rule, matcher)
+        self.any_regex = None
+        self.cache: dict[str, list] = {}
+
+    def _add_literal(self, r: Rule, lit: str, rx=None):
+        # any trigram of the literal works; pick the least used one
+        gram = min((lit[k:k + 3] for k in range(len(lit) - 2)), key=lambda g: len(self.grams.get(g, ())))
+        self.grams.setdefault(gram, []).append((r, lit, rx))
+
+    def add(self, r: Rule):
+        if r.case_sensitive or r.match_type not in ('exact', 'contains', 'fuzzy', 'regex'):
+            self.other.append((r, _compile_matcher(r)))
+            return
+        pat = r.pattern.lower()
+        if r.match_type == 'exact':
+            self.exact.setdefault(pat, []).append(r)
+        elif r.match_type == 'contains':
+            if len(pat) < 3:
+                self.short.append((r, pat))
+            else:
+                self._add_literal(r, pat)
+        elif r.match_type == 'fuzzy':
+            self.fuzzy.append((r, pat))
+        elif _BACKREF.search(r.pattern):
+            # group numbers would shift inside the combined prefilter
+            self.other.append((r, _compile_matcher(r)))
+        else:
+            try:
+                rx = re.compile(r.pattern, re.IGNORECASE)
+            except re.error:
+                self.other.append((r, _compile_matcher(r)))
+                return
+            lit = _regex_literal(r.pattern)
+            if lit:
+                self._add_literal(r, lit, rx)
+            else:
+                self.regex.append((r, rx))
+
+    def finish(self):
+        if self.regex:
+            try:
+                self.any_regex = re.compile("|".join(f"(?:{rx.pattern})" for _, rx in self.regex), re.IGNORECASE)
+            except re.error:
+                self.any_regex = None
+        self.fuzzy_patterns = [p for _, p in self.fuzzy]
+        return self
+
+    def match(self, value: str) -> list:
+        hit = self.cache.get(value)
+        if hit is not None:
+            return hit
+        low = value.lower()
+        hit = list(self.exact.get(low, ()))
+        if self.grams:
+            seen = set()
+            for k in range(len(low) - 2):
+                for r, lit, rx in self.grams.get(low[k:k + 3], ()):
+                    if id(r) not in seen and lit in low and (rx is None or rx.search(value)):
+                        seen.add(id(r))
+                        hit.append(r)
+        hit += [r for r, pat in self.short if pat in low]
+        if self.fuzzy:
+            hit += [self.fuzzy[i][0] for _, _, i in process.extract(
+                low, self.fuzzy_patterns, scorer=fuzz.ratio, score_cutoff=90, limit=None)]
+        if self.regex and (self.any_regex is None or self.any_regex.search(value)):
+            hit += [r for r, rx in self.regex if rx.search(value)]
+        hit += [r for r, m in self.other if m(value)]
+        self.cache[value] = hit
+        return hit
+
+
+def _indexed_rules(fi: _FieldIndex):
+    for rules in fi.exact.values():
+        yield from rules
+    for entries in fi.grams.values():
+        for r, _, _ in entries:
+            yield r
+    for pairs in (fi.short, fi.fuzzy, fi.regex, fi.other):
+        for r, _ in pairs:
+            yield r
+
+
+def _index_rules(rules) -> dict[str, _FieldIndex]:
+    index = {f: _FieldIndex() for f in ('counterparty', 'reference')}
+    for r in rules:
+        if r.field in index:
+            index[r.field].add(r)
+    return {f: i.finish() for f, i in index.items()}
+
+
+_sim_cache: dict = {}  # db path -> (data version, rules, tx values, rule index)
+
+
+def _sim_state():
+    """Stored rules, transaction values and their match index for the current data.
+
+    Cached per workspace until the change journal moves on, so repeated
+    previews only evaluate the edited rule.
+    """
+    key, version = str(db.db_path()), latest_seq()
+    hit = _sim_cache.get(key)
+    if hit is None or hit[0] != version:
+        rules = _load_rules()
+        hit = _sim_cache[key] = (version, rules, _load_tx_values(), _index_rules(rules))
+    return hit[1:]
+
+
+def simulate_rules(candidate: Rule | None = None, replaces: int | None = None,
+                   rules: Iterable[Rule] | None = None) -> ImpactReport:
+    """Read-only what-if of the rule set with ``candidate`` added.
+
+    If ``replaces`` is given the stored rule with that id is swapped for
+    ``candidate`` (e.g. an edited or re-enabled rule). Uses the same
+    precedence as ``choose_category_for``; every rule is evaluated once per
+    distinct normalized field value and nothing is written to the database.
+    """
+    if rules is None:
+        rules, values, index = _sim_state()
+    else:
+        values, index = _sim_state()[1], _index_rules(rules)
+    baseline = [r for r in rules if r.enabled]
+    scenario = [r for r in baseline if replaces is None or r.id != replaces]
+    if candidate is not None and candidate.enabled:
+        scenario.append(candidate)
+
+    def precedence(r):
+        rid = replaces if r is candidate else r.id
+        return MATCH_ORDER.get(r.match_type, 9), rid if rid is not None else float('inf')
+
+    return _simulate(baseline, scenario, precedence, candidate, values, index)
+
+
+def _load_rules() -> list[Rule]:
+    with get_session() as s:
+        return s.scalars(select(Rule).order_by(Rule.id)).all()
+
+
+def _rule_precedence(r: Rule):
+    return MATCH_ORDER.get(r.match_type, 9), r.id
+
+
+def _simulate(baseline, scenario, precedence, candidate=None, values=None, index=None) -> ImpactReport:
+    if values is None:
+        values = _load_tx_values()
+    ordered = sorted({id(r): r for r in baseline + scenario}.values(), key=precedence)
+    base_ids = {id(r) for r in baseline}
+    scen_ids = {id(r) for r in scenario}
+    impacts = {id(r): RuleImpact(r.id, r.category_id) for r in ordered if id(r) in scen_ids}
+    base_rank = {id(r): i for i, r in enumerate(r for r in ordered if id(r) in base_ids)}
+    scen_rank = {id(r): i for i, r in enumerate(r for r in ordered if id(r) in scen_ids)}
+    n_base, n_scen = len(base_rank), len(scen_rank)
+    pos = {id(r): i for i, r in enumerate(ordered)}
+
+    # rules missing from the (cached) index, e.g. a candidate, are few: test them directly
+    if index is None:
+        index = _index_rules(ordered)
+    indexed = {id(r) for fi in index.values() for r in _indexed_rules(fi)}
+    extra = {f: [(pos[id(r)], _compile_matcher(r)) for r in ordered if r.field == f and id(r) not in indexed]
+             for f in index}
+
+    def matching(fld, value):
+        if not value:
+            return []
+        hit = [pos[id(r)] for r in index[fld].match(value) if id(r) in pos]
+        return hit + [i for i, m in extra[fld] if m(value)]
+
+    changed = before = after = evals_before = evals_after = 0
+    displaced = set()
+    for (cp, ref), amounts in values.items():
+        idx = sorted(matching('counterparty', cp) + matching('reference', ref))
+        if not idx:
+            evals_before += n_base * len(amounts)
+            evals_after += n_scen * len(amounts)
+            continue
+        matched = [ordered[i] for i in idx]
+        for amount in amounts:
+            old = _winner(matched, amount, base_ids)
+            new = _winner(matched, amount, scen_ids)
+            before += old is not None
+            after += new is not None
+            evals_before += base_rank[id(old)] + 1 if old is not None else n_base
+            evals_after += scen_rank[id(new)] + 1 if new is not None else n_scen
+            if _category(old) != _category(new):
+                changed += 1
+                if old is not None:
+                    displaced.add(old.id)
+            for r in matched:
+                imp = impacts.get(id(r))
+                if imp is None or not _in_range(r, amount):
+                    continue
+                imp.matches += 1
+                if r is new:
+                    imp.wins += 1
+                    if old is None:
+                        imp.new += 1
+                    elif old.category_id != r.category_id:
+                        imp.taken[old.category_id] = imp.taken.get(old.category_id, 0) + 1
+                else:
+                    imp.shadowed_by[new.category_id] = imp.shadowed_by.get(new.category_id, 0) + 1
+    return ImpactReport(
+        rules=list(impacts.values()),
+        candidate=impacts.get(id(candidate)) if candidate is not None else None,
+        changed=changed,
+        categorized_before=before,
+        categorized_after=after,
+        evaluations_before=evals_before,
+        evaluations_after=evals_after,
+        displaced_rule_ids=displaced,
+    )
+
+
+@dataclass
+class CompactionItem:
+    rule_id: int
+    reason: str  # 'duplicate' | 'subsumed' | 'shadowed'
+    kept_rule_id: int | None
+    detail: str
+
+
+@dataclass
+class CompactionPlan:
+    items: list  # CompactionItem, one per rule proposed for removal
+    unused: list  # enabled rule ids that match no transaction (kept)
+    rules_before: int
+    evaluations_before: int
+    evaluations_after: int
+
+    @property
+    def rule_ids(self) -> list[int]:
+        return [i.rule_id for i in self.items]
+
+    @property
+    def speedup(self) -> float:
+        """Estimated rule application speedup (rule evaluations before/after)."""
+        return self.evaluations_before / self.evaluations_after if self.evaluations_after else 1.0
+
+
+def _pattern_key(r: Rule) -> str:
+    return r.pattern if r.case_sensitive else r.pattern.lower()
+
+
+def _covers(outer: Rule, inner: Rule) -> bool:
+    """True if ``outer``'s amount range contains ``inner``'s."""
+    if outer.amount_min is not None and (inner.amount_min is None or inner.amount_min < outer.amount_min):
+        return False
+    if outer.amount_max is not None and (inner.amount_max is None or inner.amount_max > outer.amount_max):
+        return False
+    return True
+
+
+def _implies(general: Rule, specific: Rule) -> bool:
+    """True if every value ``specific`` matches is also matched by ``general``."""
+    if general.field != specific.field or general.case_sensitive or specific.case_sensitive:
+        return False
+    if not _covers(general, specific):
+        return False
+    if general.match_type == 'contains' and specific.match_type in ('contains', 'exact'):
+        return general.pattern.lower() in specific.pattern.lower()
+    if general.match_type == 'exact' and specific.match_type == 'exact':
+        return general.pattern.lower() == specific.pattern.lower()
+    return False
+
+
+def analyze_rule_compaction(rules: Iterable[Rule] | None = None) -> CompactionPlan:
+    """Find enabled rules that can be removed without changing any outcome.
+
+    * duplicate: same category, field, match type, pattern and amount range
+      as an earlier rule;
+    * subsumed: a rule of the same category matches everything it matches;
+    * shadowed: an earlier rule of another category always matches first.
+
+    Only these statically proven cases are planned; a rule that merely never
+    wins on the observed transactions may still be the one that covers
+    future ones. The plan is also checked against the observed transactions
+    and rules whose removal would change a category are dropped from it.
+    Nothing is written.
+    """
+    if rules is None:
+        rules, values, index = _sim_state()
+    else:
+        values, index = _sim_state()[1], _index_rules(rules)
+    enabled = sorted((r for r in rules if r.enabled), key=_rule_precedence)
+    items: dict[int, CompactionItem] = {}
+
+    seen = {}
+    for r in enabled:
+        key = (r.category_id, r.field, r.match_type, bool(r.case_sensitive), _pattern_key(r),
+               r.amount_min, r.amount_max)
+        if key in seen:
+            items[r.id] = CompactionItem(r.id, 'duplicate', seen[key].id, f"same as #{seen[key].id}")
+        else:
+            seen[key] = r
+
+    # only contains/exact patterns can imply each other
+    by_field: dict[str, list[Rule]] = {}
+    for r in enabled:
+        if r.id not in items and r.match_type in ('contains', 'exact'):
+            by_field.setdefault(r.field, []).append(r)
+    for group in by_field.values():
+        for r in group:
+            for q in group:
+                if q is r or q.id in items or not _implies(q, r):
+                    continue
+                if q.category_id == r.category_id:
+                    items[r.id] = CompactionItem(
+                        r.id, 'subsumed', q.id, f"#{q.id} {q.match_type} '{q.pattern}' covers it")
+                    break
+                if _rule_precedence(q) < _rule_precedence(r):
+                    items[r.id] = CompactionItem(
+                        r.id, 'shadowed', q.id, f"#{q.id} {q.match_type} '{q.pattern}' always wins first")
+                    break
+
+    current = _simulate(enabled, enabled, _rule_precedence, values=values, index=index)
+    unused = []
+    for imp in current.rules:
+        if imp.rule_id not in items and imp.matches == 0:
+            unused.append(imp.rule_id)
+
+    while True:
+        report = _simulate(enabled, [r for r in enabled if r.id not in items], _rule_precedence,
+                           values=values, index=index)
+        unsafe = report.displaced_rule_ids & items.keys()
+        if not unsafe:
+            break
+        for rid in unsafe:
+            del items[rid]
+
+    return CompactionPlan(
+        items=sorted(items.values(), key=lambda i: i.rule_id),
+        unused=unused,
+        rules_before=len(enabled),
+        evaluations_before=report.evaluations_before,
+        evaluations_after=report.evaluations_after,
+    )
+
+
+def apply_compaction(plan: CompactionPlan, rule_ids: Iterable[int] | None = None) -> int:
+    """Delete the planned rules (or the selected subset of them).
+
+    Assignments made by a removed duplicate/subsumed rule are credited to the
+    rule that replaces it; others keep their category with ``rule_id`` cleared.
+    Returns the number of rules deleted.
+    """
+    selected = set(plan.rule_ids if rule_ids is None else rule_ids) & set(plan.rule_ids)
+    kept = {
+        i.rule_id: i.kept_rule_id if i.reason in ('duplicate', 'subsumed') else None
+        for i in plan.items if i.rule_id in selected
+    }
+
+    def resolve(rid):
+        while rid in kept:
+            rid = kept[rid]
+        return rid
+
+    targets: dict[int | None, list[int]] = {}
+    for rid in kept:
+        targets.setdefault(resolve(rid), []).append(rid)
+    with get_session() as s:
+        for target, ids in targets.items():
+            s.execute(update(Assignment).where(Assignment.rule_id.in_(ids)).values(rule_id=target))
+        s.execute(delete(Rule).where(Rule.id.in_(selected)))
+    return len(selected)
@@ -0,0 +1,174 @@
+"""Consistent online snapshots of the SQLite database.
+
+Snapshots are taken with SQLite's online backup API (copied a few pages at
+a time, so writers are never blocked for long) or ``VACUUM INTO`` (one
+statement, compacted output). With the WAL journal set up in ``core.db``
+neither blocks concurrent writers. Snapshots live in ``data/snapshots`` and
+can be gzip-compressed chunk by chunk after the copy is taken.
+"""
+
+from __future__ import annotations
+
+import gzip
+import re
+import shutil
+import sqlite3
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from . import db
+from .db import get_session
+from .models import Setting
+
+BACKUP_PAGES_PER_STEP = 1024
+CHUNK_SIZE = 1024 * 1024
+DOWNLOAD_MAX_AGE_HOURS = 24
+
+# settings table keys and defaults for scheduled snapshots
+SETTING_INTERVAL_HOURS = "snapshot_interval_hours"
+SETTING_KEEP = "snapshot_keep"
+SETTING_MAX_AGE_DAYS = "snapshot_max_age_days"
+SETTING_LAST = "snapshot_last"
+DEFAULTS = {SETTING_INTERVAL_HOURS: 24.0, SETTING_KEEP: 7, SETTING_MAX_AGE_DAYS: 30}
+
+
+def snapshot_dir() -> Path:
+    return db.db_path().parent / "snapshots"
+
+
+def download_dir() -> Path:
+    # on-demand downloads live apart from the scheduled ones so retention never removes them
+    return snapshot_dir() / "downloads"
+
+
+def _snapshot_name(compress: bool) -> str:
+    # microseconds keep snapshots taken within the same second apart
+    stamp = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+    return f"{db.db_path().stem}-{stamp}.db" + (".gz" if compress else "")
+
+
+def _snapshot_pattern() -> re.Pattern:
+    return re.compile(rf"^{re.escape(db.db_path().stem)}-\d{{8}}-\d{{6}}(-\d{{6}})?\.db(\.gz)?$")
+
+
+def _backup_to(dest: Path, method: str):
+    src = sqlite3.connect(db.db_path())
+    try:
+        if method == "vacuum":
+            src.execute("VACUUM INTO ?", (str(dest),))
+        elif method == "backup":
+            dst = sqlite3.connect(dest)
+            try:
+                src.backup(dst, pages=BACKUP_PAGES_PER_STEP, sleep=0.005)
+                # the copy keeps WAL mode; switch back so it is a single file
+                dst.execute("PRAGMA journal_mode=DELETE")
+                dst.execute("VACUUM")
+            finally:
+                dst.close()
+        else:
+            raise ValueError(f"Unknown snapshot method: {method}")
+    finally:
+        src.close()
+
+
+def create_snapshot(method: str = "vacuum", compress: bool = False, dest: Path | None = None) -> Path:
+    """Write a consistent, compacted copy of the live database and return its path."""
+    db.ensure_db()
+    if dest is None:
+        dest = snapshot_dir() / _snapshot_name(compress)
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    raw = dest.with_name(dest.name[:-3]) if compress else dest
+    tmp = raw.with_name(raw.name + ".tmp")
+    tmp.unlink(missing_ok=True)
+    try:
+        _backup_to(tmp, method)
+        if compress:
+            with open(tmp, "rb") as src, gzip.open(dest, "wb", compresslevel=6) as out:
+                shutil.copyfileobj(src, out, CHUNK_SIZE)
+            tmp.unlink()
+        else:
+            tmp.replace(dest)
+    finally:
+        tmp.unlink(missing_ok=True)
+    return dest
+
+
+def create_download_snapshot(compress: bool = True, max_age_hours: float = DOWNLOAD_MAX_AGE_HOURS) -> Path:
+    """Snapshot for an on-demand download, kept outside scheduled retention.
+
+    Earlier download snapshots older than ``max_age_hours`` are removed.
+    """
+    d = download_dir()
+    if d.exists():
+        pat = _snapshot_pattern()
+        cutoff = datetime.now() - timedelta(hours=max_age_hours)
+        for p in d.iterdir():
+            if pat.match(p.name) and datetime.fromtimestamp(p.stat().st_mtime) < cutoff:
+                p.unlink(missing_ok=True)
+    return create_snapshot(compress=compress, dest=d / _snapshot_name(compress))
+
+
+def iter_chunks(path: Path, chunk_size: int = CHUNK_SIZE):
+    """Yield a file's bytes in chunks, e.g. to stream a snapshot elsewhere."""
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            yield chunk
+
+
+def list_snapshots() -> list[Path]:
+    """Snapshots of the current workspace, newest first."""
+    d = snapshot_dir()
+    if not d.exists():
+        return []
+    # only this workspace's snapshots share the directory's naming prefix
+    pat = _snapshot_pattern()
+    files = [p for p in d.iterdir() if p.is_file() and pat.match(p.name)]
+    return sorted(files, key=lambda p: p.stat().st_mtime, reverse=True)
+
+
+def prune_snapshots(keep: int, max_age_days: float | None = None) -> list[Path]:
+    """Keep the newest ``keep`` snapshots, also dropping any older than ``max_age_days``."""
+    removed = []
+    cutoff = datetime.now() - timedelta(days=max_age_days) if max_age_days else None
+    for i, p in enumerate(list_snapshots()):
+        too_old = cutoff is not None and datetime.fromtimestamp(p.stat().st_mtime) < cutoff
+        if i >= keep or too_old:
+            p.unlink(missing_ok=True)
+            removed.append(p)
+    return removed
+
+
+def get_schedule() -> dict:
+    with get_session() as s:
+        rows = {r.key: r.value for r in s.query(Setting).filter(Setting.key.in_(list(DEFAULTS) + [SETTING_LAST]))}
+    sched = {k: type(v)(rows[k]) if k in rows else v for k, v in DEFAULTS.items()}
+    sched[SETTING_LAST] = datetime.fromisoformat(rows[SETTING_LAST]) if SETTING_LAST in rows else None
+    return sched
+
+
+def set_schedule(interval_hours: float, keep: int, max_age_days: float):
+    with get_session() as s:
+        s.merge(Setting(key=SETTING_INTERVAL_HOURS, value=str(float(interval_hours))))
+        s.merge(Setting(key=SETTING_KEEP, value=str(int(keep))))
+        s.merge(Setting(key=SETTING_MAX_AGE_DAYS, value=str(int(max_age_days))))
+
+
+def run_scheduled_snapshot(now: datetime | None = None) -> Path | None:
+    """Take a compressed snapshot if the interval has elapsed, then apply retention.
+
+    An interval of 0 disables scheduled snapshots. Returns the new snapshot
+    path, or ``None`` if none was due.
+    """
+    now = now or datetime.now()
+    sched = get_schedule()
+    interval = sched[SETTING_INTERVAL_HOURS]
+    if interval <= 0:
+        return None
+    last = sched[SETTING_LAST]
+    if last is not None and now - last < timedelta(hours=interval):
+        return None
+    path = create_snapshot(compress=True)
+    with get_session() as s:
+        s.merge(Setting(key=SETTING_LAST, value=now.isoformat()))
+    prune_snapshots(sched[SETTING_KEEP], sched[SETTING_MAX_AGE_DAYS])
+    return path
@@ -0,0 +1,144 @@
+"""Monthly spending trends per category, computed inside SQLite.
+
+One statement builds the monthly totals per category (across the hot
+database and any archived years the range reaches), fills months without
+spending with zeros and derives rolling averages, year-over-year deltas and
+threshold flags with window functions. Only the final rows leave SQLite.
+"""
+
+from __future__ import annotations
+
+from datetime import date
+
+from sqlalchemy import and_, case, func, select, true, union_all, update
+
+from . import partitions
+from .db import get_session
+from .models import Assignment, Category, Transaction
+from .queries import transaction_filter_conditions
+
+TREND_COLUMNS = [
+    "month", "category_id", "category", "total", "avg_3m", "avg_12m",
+    "prev_year", "yoy_delta", "yoy_pct", "threshold", "over_threshold",
+]
+
+
+def _month_start(d: date, months_back: int = 0) -> date:
+    m = d.year * 12 + d.month - 1 - months_back
+    return date(m // 12, m % 12 + 1, 1)
+
+
+def _amounts(T, A, filters, include_income, category_ids):
+    conds = transaction_filter_conditions(filters, T, A)
+    if not include_income:
+        conds.append(T.is_income == False)  # noqa
+    if category_ids:
+        conds.append(A.category_id.in_(category_ids))
+    return (
+        select(
+            func.strftime('%Y-%m-01', T.completed_at).label('month'),
+            A.category_id.label('category_id'),
+            func.abs(T.amount).label('amount'),
+        )
+        .select_from(T)
+        .join(A, and_(A.transaction_id == T.id, A.source != 'model'), isouter=True)
+        .where(true(), *conds)
+    )
+
+
+def _trend_query(parts, date_from: date | None):
+    data = (parts[0] if len(parts) == 1 else union_all(*parts)).subquery('data')
+    monthly = (
+        select(data.c.month, data.c.category_id, func.sum(data.c.amount).label('total'))
+        .group_by(data.c.month, data.c.category_id)
+        .cte('monthly')
+    )
+    bounds = select(
+        func.min(monthly.c.month).label('lo'), func.max(monthly.c.month).label('hi')
+    ).cte('bounds')
+    months = select(bounds.c.lo.label('month')).where(bounds.c.lo.is_not(None)).cte('months', recursive=True)
+    months = months.union_all(
+        select(func.date(months.c.month, '+1 month'))
+        .select_from(months).join(bounds, true())
+        .where(months.c.month < bounds.c.hi)
+    )
+    cats = select(monthly.c.category_id).distinct().cte('cats')
+    # dense grid: months without spending count as 0 in the windows below
+    grid = (
+        select(months.c.month, cats.c.category_id, func.coalesce(monthly.c.total, 0.0).label('total'))
+        .select_from(months).join(cats, true())
+        .join(monthly, and_(
+            monthly.c.month == months.c.month,
+            monthly.c.category_id.is_not_distinct_from(cats.c.category_id),
+        ), isouter=True)
+        .subquery('grid')
+    )
+
+    def window(fn, rows=None):
+        return fn.over(partition_by=grid.c.category_id, order_by=grid.c.month, rows=rows)
+
+    series = select(
+        grid.c.month,
+        grid.c.category_id,
+        grid.c.total,
+        window(func.avg(grid.c.total), rows=(-2, 0)).label('avg_3m'),
+        window(func.avg(grid.c.total), rows=(-11, 0)).label('avg_12m'),
+        window(func.lag(grid.c.total, 12)).label('prev_year'),
+    ).subquery('series')
+
+    total, prev = series.c.total, series.c.prev_year
+    q = (
+        select(
+            func.strftime('%Y-%m', series.c.month).label('month'),
+            series.c.category_id,
+            Category.name.label('category'),
+            total,
+            series.c.avg_3m,
+            series.c.avg_12m,
+            prev,
+            (total - prev).label('yoy_delta'),
+            case((prev > 0, (total - prev) / prev)).label('yoy_pct'),
+            Category.threshold_amount.label('threshold'),
+            case(
+                (and_(Category.threshold_amount.is_not(None), total > Category.threshold_amount), True),
+                else_=False,
+            ).label('over_threshold'),
+        )
+        .select_from(series)
+        .join(Category, Category.id == series.c.category_id, isouter=True)
+        .order_by(series.c.month, Category.name)
+    )
+    if date_from:
+        q = q.where(series.c.month >= _month_start(date_from).isoformat())
+    return q
+
+
+def monthly_trends(date_from: date | None = None, date_to: date | None = None,
+                   category_ids: list[int] | None = None, include_income: bool = False) -> list[dict]:
+    """Monthly totals per category with rolling averages, YoY and threshold flags.
+
+    Rows are dicts keyed by ``TREND_COLUMNS``, ordered by month then category;
+    ``category`` is ``None`` for uncategorized spending. ``avg_3m``/``avg_12m``
+    average the month and its 2/11 predecessors (fewer at the start of the
+    data), ``prev_year`` is the same month a year earlier. Months before
+    ``date_from`` are still read so the first rows get full windows; archived
+    years are read only when the range (including that history) reaches them.
+    """
+    hist_from = _month_start(date_from, 12) if date_from else None
+    filters = {'date_from': hist_from, 'date_to': date_to}
+    years = partitions.years_in_range(hist_from, date_to) if (date_from or date_to) else []
+    with get_session() as s, partitions.attached(s, years):
+        parts = [_amounts(Transaction, Assignment, filters, include_income, category_ids)]
+        parts += [_amounts(*partitions.entities(y), filters, include_income, category_ids) for y in years]
+        return [dict(r) for r in s.execute(_trend_query(parts, date_from)).mappings()]
+
+
+def set_thresholds(thresholds: dict[int, float | None]):
+    """Persist monthly spending thresholds (``None`` clears one) by category id."""
+    if not thresholds:
+        return
+    with get_session() as s:
+        s.execute(update(Category), [
+            {"id": cid, "threshold_amount": None if v is None else float(v)}
+            for cid, v in thresholds.items()
+        ])
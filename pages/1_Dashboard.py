@@ -1,39 +1,73 @@
 import streamlit as st
 import pandas as pd
 import altair as alt
-from core.queries import monthly_expense_by_category
+from datetime import date
+from core.trends import TREND_COLUMNS, monthly_trends, set_thresholds
+from core.partitions import archived_years
+from ui import workspace_sidebar
 
+workspace_sidebar()
 st.title("Dashboard")
 
 include_income = st.checkbox(
     "Include Income/Refunds (positive amounts)", value=False
 )
 
-rows = monthly_expense_by_category(include_income=include_income)
+archived = archived_years()
+include_archived = archived and st.checkbox(
+    f"Include archived years ({', '.join(map(str, archived))})", value=False
+)
+date_from = date(1900, 1, 1) if include_archived else None
+
+# monthly series per category with rolling averages, YoY and threshold flags, all computed in SQLite
+rows = monthly_trends(date_from=date_from, include_income=include_income)
 if not rows:
     st.info("No data yet. Upload CSV on the Transactions page.")
 else:
-    df = pd.DataFrame(
-        [
-            {
-                "month": r[0],
-                "category": r[1] or "Uncategorized",
-                "total": r[2],
-            }
-            for r in rows
-        ]
-    )
+    df = pd.DataFrame(rows, columns=TREND_COLUMNS)
+    df["category"] = df["category"].fillna("Uncategorized")
     months = sorted(df["month"].unique())
+
+    st.markdown("### Trends")
+    if len(months) > 1:
+        start, end = st.select_slider(
+            "Months", options=months, value=(months[max(0, len(months) - 12)], months[-1])
+        )
+    else:
+        start = end = months[0]
+    df_range = df[(df["month"] >= start) & (df["month"] <= end)]
+    by_total = df_range.groupby("category")["total"].sum().sort_values(ascending=False)
+    trend_cats = st.multiselect(
+        "Categories to show", options=list(by_total.index), default=list(by_total.index[:8]),
+        key="trend_categories",
+    )
+    measures = {"Monthly total": "total", "3-month average": "avg_3m", "12-month average": "avg_12m"}
+    measure = measures[st.radio("Measure", options=list(measures), horizontal=True)]
+    df_trend = df_range[df_range["category"].isin(trend_cats)]
+    lines = alt.Chart(df_trend).mark_line(point=True).encode(
+        x=alt.X("month:O", title="Month"),
+        y=alt.Y(f"{measure}:Q", title="Amount"),
+        color="category:N",
+        tooltip=["month", "category", "total", "avg_3m", "avg_12m", "yoy_delta", "threshold"],
+    )
+    over = alt.Chart(df_trend[df_trend["over_threshold"]]).mark_point(
+        color="red", size=120, shape="diamond", filled=True
+    ).encode(x="month:O", y=f"{measure}:Q", tooltip=["month", "category", "total", "threshold"])
+    st.altair_chart((lines + over).properties(height=420), use_container_width=True)
+    st.caption("Red diamonds mark months where a category's total exceeded its threshold.")
+
+    st.markdown("### Month")
     selected_month = st.selectbox(
         "Month", options=months, index=len(months) - 1
     )
-    df_month = df[df["month"] == selected_month]
+    df_month = df[(df["month"] == selected_month) & (df["total"] > 0)]
     categories = sorted(df_month["category"].unique())
     selected = st.multiselect(
         "Categories to show", options=categories, default=categories
     )
     df_month = df_month[df_month["category"].isin(selected)]
     df_month = df_month.sort_values("total", ascending=False)
+    df_month["yoy_pct"] = df_month["yoy_pct"] * 100
     chart = (
         alt.Chart(df_month)
         .mark_bar()
@@ -41,26 +75,32 @@ else:
             x=alt.X("category:N", sort="-y"),
             y=alt.Y("total:Q"),
             color="category:N",
-            tooltip=["category", "total"],
+            tooltip=["category", "total", "avg_3m", "yoy_delta"],
         )
         .properties(height=420, title=f"Expenses for {selected_month}")
     )
     st.altair_chart(chart, use_container_width=True)
 
     st.markdown("### Thresholds")
-    for cat in selected:
-        st.number_input(
-            f"{cat} threshold",
-            value=0.0,
-            step=10.0,
-            key=f"th_{selected_month}_{cat}",
-        )
-    df_month["threshold"] = df_month["category"].map(
-        lambda c: st.session_state.get(f"th_{selected_month}_{c}", 0.0)
-    )
-    df_month["over"] = df_month["total"] > df_month["threshold"]
-    st.dataframe(
-        df_month[["category", "total", "threshold", "over"]],
+    st.caption("Monthly thresholds are saved per category.")
+    edited = st.data_editor(
+        df_month[["category_id", "category", "total", "avg_3m", "avg_12m", "yoy_pct", "threshold", "over_threshold"]],
+        column_config={
+            "category_id": None,
+            "yoy_pct": st.column_config.NumberColumn("YoY", format="%+.0f%%"),
+            "threshold": st.column_config.NumberColumn("threshold", min_value=0.0, step=10.0),
+            "over_threshold": st.column_config.CheckboxColumn("over"),
+        },
+        disabled=["category", "total", "avg_3m", "avg_12m", "yoy_pct", "over_threshold"],
         use_container_width=True,
         hide_index=True,
+        key=f"thresholds_{selected_month}",
     )
+    if st.button("Save thresholds"):
+        changed = {
+            int(r.category_id): None if pd.isna(r.threshold) else float(r.threshold)
+            for r, old in zip(edited.itertuples(), df_month["threshold"])
+            if pd.notna(r.category_id) and not (pd.isna(r.threshold) and pd.isna(old)) and r.threshold != old
+        }
+        set_thresholds(changed)
+        st.rerun()
@@ -4,12 +4,16 @@ from sqlalchemy import select
 import io
 from core.ingestion import ingest_csv
 from core.rules import apply_rules_to_uncategorized
-from core.categorize import set_category_manual, create_rule_from_tx
-from core.queries import fetch_transactions, categories_list
+from core.categorize import set_category_manual, set_category_by_filter, create_rule_from_tx
+from core.queries import fetch_transactions, search_transactions, categories_list, count_hot_transactions
 from core.db import get_session
 from core.models import Transaction, Assignment, Category
 from core import gdrive
+from core.classifier import suggest_categories, accept_suggestions, discard_suggestions
+from core.export import export_to_drive, export_filename, legacy_filenames
+from ui import workspace_sidebar
 
+workspace_sidebar()
 st.title("Transactions")
 
 st.subheader("Upload CSV")
@@ -36,14 +40,46 @@ elif income_toggle == "Income/Refunds":
     income_filter = True
 else:
     income_filter = None
+text_filter = col3.text_input("Search counterparty / reference")
+
+col4, col5, col6 = st.columns(3)
+date_range = col4.date_input("Date range", value=())
+amt_min_str = col5.text_input("Min amount")
+amt_max_str = col6.text_input("Max amount")
 
 filters = {}
 if uncat_only:
     filters['uncategorized'] = True
 if income_filter is not None:
     filters['income'] = income_filter
+if text_filter.strip():
+    filters['text'] = text_filter.strip()
+if len(date_range) == 2:
+    filters['date_from'], filters['date_to'] = date_range
+amount_bounds = {}
+for key, raw in (('amount_min', amt_min_str), ('amount_max', amt_max_str)):
+    if raw.strip():
+        try:
+            amount_bounds[key] = float(raw)
+        except ValueError:
+            amount_bounds = None
+            break
+if amount_bounds is None:
+    # never apply just one bound when the user was told the filter is ignored
+    st.warning("Amounts must be numbers; amount filter ignored.")
+else:
+    filters.update(amount_bounds)
 
-rows = fetch_transactions(filters=filters)
+SEARCH_PAGE_SIZE = 200
+if 'text' in filters:
+    page_no = st.number_input("Results page", min_value=1, step=1, value=1)
+    rows, match_count = search_transactions(
+        filters['text'], filters, limit=SEARCH_PAGE_SIZE, offset=(int(page_no) - 1) * SEARCH_PAGE_SIZE
+    )
+    st.caption(f"{match_count} matches, best first")
+else:
+    rows = fetch_transactions(filters=filters)
+    match_count = len(rows)
 
 if not rows:
     st.info("No transactions to show yet.")
@@ -54,34 +90,38 @@ else:
         'counterparty': t.counterparty,
         'reference': t.reference,
         'amount': t.amount,
-        'category': (c.name if c else None)
+        'category': (c.name if c else None),
+        'source': (a.source if a else None),
+        'confidence': (a.confidence if a else None),
     } for (t, a, c) in rows])
     st.dataframe(df, use_container_width=True, hide_index=True)
 
     up_col, down_col = st.columns(2)
     if up_col.button("Upload to Drive"):
-        export_map = {
-            'id': 'ID',
-            'date': 'Completed date',
-            'counterparty': 'Counterparty name',
-            'reference': 'Reference',
-            'amount': 'Amount',
-            'category': 'Category',
-        }
-        gdrive.upload_df(df.rename(columns=export_map), "transactions.csv")
+        export_to_drive("transactions")
         st.success("Uploaded transactions to Google Drive")
+    force_sync = down_col.checkbox("Re-download even if unchanged", value=False)
     if down_col.button("Download from Drive"):
-        drive_df = gdrive.download_df("transactions.csv")
-        if drive_df is None:
-            st.error("transactions.csv not found on Drive")
+        drive_name = export_filename("transactions")
+        result = gdrive.sync_df(drive_name, force=force_sync, fallbacks=legacy_filenames("transactions"))
+        if result.status == "missing":
+            st.error(f"{drive_name} not found on Drive")
+        elif result.status == "unchanged":
+            st.info(f"{drive_name} has not changed since the last download.")
         else:
+            drive_df = result.df
             buf = io.StringIO()
             drive_df.to_csv(buf, index=False)
             buf.seek(0)
-            rows_in, rows_skip = ingest_csv(buf, batch_name="drive_transactions.csv")
-            st.success(f"Ingested {rows_in} rows, skipped {rows_skip} duplicates.")
-            apply_rules_to_uncategorized()
-            st.info("Applied rules to uncategorized transactions.")
+            try:
+                rows_in, rows_skip = ingest_csv(buf, batch_name="drive_transactions.csv")
+            except ValueError as e:
+                st.error(f"Could not ingest {drive_name}: {e}")
+            else:
+                result.commit()
+                st.success(f"Ingested {rows_in} rows, skipped {rows_skip} duplicates.")
+                apply_rules_to_uncategorized()
+                st.info("Applied rules to uncategorized transactions.")
 
     st.markdown("#### Quick edit")
     tx_ids_str = st.text_input("Transaction IDs (comma separated) to set category")
@@ -92,10 +132,39 @@ else:
         except ValueError:
             ids = []
         if ids:
-            set_category_manual(ids, cat_by_name[selected_cat])
-            st.success(f"Updated {len(ids)} transactions.")
+            n = set_category_manual(ids, cat_by_name[selected_cat])
+            st.success(f"Updated {n} transactions.")
+            if n < len(ids):
+                st.warning(f"{len(ids) - n} IDs were not found or belong to read-only archived years.")
         else:
             st.warning("Provide valid IDs.")
+    editable_count = count_hot_transactions(filters)
+    if editable_count < match_count:
+        st.caption(f"{match_count - editable_count} of the matches are in read-only archived years and are not changed.")
+    # without a narrowing filter the bulk edit would turn every expense (or income) into a manual assignment
+    narrowed = any(k != 'income' for k in filters)
+    confirmed = narrowed or st.checkbox(
+        f"No filter narrows the selection: confirm recategorizing all {editable_count} transactions as manual",
+        value=False, key="bulk_apply_confirm",
+    )
+    if st.button(f"Apply category to all {editable_count} filtered transactions", disabled=not confirmed):
+        n = set_category_by_filter(filters, cat_by_name[selected_cat])
+        st.success(f"Updated {n} transactions.")
+
+    st.markdown("#### Suggest categories with ML")
+    st.caption("Trains on your rule and manual assignments and suggests categories for uncategorized expenses.")
+    if st.button("Suggest categories for uncategorized"):
+        n = suggest_categories()
+        if n:
+            st.success(f"Stored {n} suggestions.")
+        else:
+            st.warning("Not enough categorized transactions to train a model yet.")
+    min_conf = st.slider("Minimum confidence to accept", min_value=0.0, max_value=1.0, value=0.8, step=0.05)
+    s_col1, s_col2 = st.columns(2)
+    if s_col1.button("Accept suggestions"):
+        st.success(f"Accepted {accept_suggestions(min_conf)} suggestions.")
+    if s_col2.button("Discard all suggestions"):
+        st.info(f"Discarded {discard_suggestions()} suggestions.")
 
     st.markdown("#### Create rule from a single transaction")
     tx_id_rule = st.number_input("Transaction ID", min_value=1, step=1, value=1)
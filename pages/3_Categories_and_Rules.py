@@ -5,9 +5,17 @@ from core.models import Category, Rule
 from core.rules import (
     apply_rules_to_all,
     apply_rule_to_all_transactions,
+    simulate_rules,
+    analyze_rule_compaction,
+    apply_compaction,
+    rule_key_conflicts,
 )
 from core import gdrive
+from core.export import export_to_drive, export_filename, legacy_filenames
+from core.importers import import_categories, import_rules, seed_from_categories_xlsx
+from ui import workspace_sidebar
 
+workspace_sidebar()
 st.title("Categories & Rules")
 
 st.subheader("Categories")
@@ -28,33 +36,16 @@ with get_session() as s:
 
     c_up, c_down = st.columns(2)
     if c_up.button("Upload Categories to Drive"):
-        export_map = {
-            "id": "ID",
-            "name": "Name",
-            "description": "Description",
-            "active": "Active",
-        }
-        gdrive.upload_df(df.rename(columns=export_map), "categories.csv")
+        export_to_drive("categories")
         st.success("Categories uploaded to Google Drive")
     if c_down.button("Download Categories from Drive"):
-        drive_df = gdrive.download_df("categories.csv")
+        drive_df = gdrive.download_df(export_filename("categories"), fallbacks=legacy_filenames("categories"))
         if drive_df is None:
-            st.error("categories.csv not found on Drive")
+            st.error(f"{export_filename('categories')} not found on Drive")
         else:
             rev_map = {"ID": "id", "Name": "name", "Description": "description", "Active": "active"}
-            drive_df = drive_df.rename(columns=rev_map)
-            with get_session() as s:
-                for _, r in drive_df.iterrows():
-                    name = str(r.get("name", "")).strip()
-                    if not name:
-                        continue
-                    c = s.query(Category).filter(Category.name == name).one_or_none()
-                    if not c:
-                        c = Category(name=name)
-                        s.add(c)
-                    c.description = r.get("description")
-                    c.is_active = bool(r.get("active", True))
-            st.success("Categories imported from Drive")
+            summary = import_categories(drive_df.rename(columns=rev_map))
+            st.success(f"Categories imported from Drive: {summary}")
 
 with st.expander("Add / Update Category"):
     name = st.text_input("Name")
@@ -75,49 +66,11 @@ st.divider()
 st.subheader("Import Categories.xlsx (creates 'contains' rules from Providers)")
 file = st.file_uploader("Upload Categories.xlsx", type=["xlsx"])
 if file is not None and st.button("Import & Seed Rules"):
-    xdf = pd.read_excel(file)
-    # Expect columns: Categories, Description, Providers, Additional comment
-    required = ['Categories', 'Description', 'Providers']
-    if any(col not in xdf.columns for col in required):
-        st.error(f"Missing required columns in Excel. Found: {list(xdf.columns)}")
+    try:
+        added_cats, added_rules = seed_from_categories_xlsx(file)
+    except ValueError as e:
+        st.error(str(e))
     else:
-        added_cats = 0
-        added_rules = 0
-        with get_session() as s:
-            for _, r in xdf.iterrows():
-                name = str(r['Categories']).strip()
-                desc = str(r.get('Description', '')).strip() or None
-                comment = str(r.get('Additional comment', '')).strip() or None
-                c = s.query(Category).filter(Category.name == name).one_or_none()
-                if not c:
-                    c = Category(name=name, description=desc, comment=comment, is_active=True)
-                    s.add(c)
-                    s.flush()
-                    added_cats += 1
-                providers = str(r.get('Providers', '') or '').strip()
-                if providers:
-                    for p in [x.strip() for x in providers.split(',') if x.strip()]:
-                        # create 'contains' rule on counterparty
-                        existing = (
-                            s.query(Rule)
-                            .filter(
-                                Rule.category_id == c.id,
-                                Rule.field == "counterparty",
-                                Rule.match_type == "contains",
-                                Rule.pattern == p,
-                            )
-                            .one_or_none()
-                        )
-                        if not existing:
-                            s.add(
-                                Rule(
-                                    category_id=c.id,
-                                    field="counterparty",
-                                    match_type="contains",
-                                    pattern=p,
-                                )
-                            )
-                            added_rules += 1
         st.success(f"Imported. Added categories: {added_cats}, rules: {added_rules}")
         st.info("Go to Transactions → Re-apply rules (ingest a CSV first).")
 
@@ -142,26 +95,20 @@ with get_session() as s:
         ]
     )
     st.dataframe(df, use_container_width=True, hide_index=True)
+    for group in rule_key_conflicts():
+        st.warning(
+            f"Rules {', '.join(f'#{i}' for i in group)} share category, field, type and pattern "
+            "but differ in amount range or case; merge or delete them so duplicates can be prevented."
+        )
 
     r_up, r_down = st.columns(2)
     if r_up.button("Upload Rules to Drive"):
-        export_map = {
-            "id": "ID",
-            "category_id": "Category ID",
-            "category": "Category",
-            "field": "Field",
-            "type": "Type",
-            "pattern": "Pattern",
-            "amount_min": "Amount Min",
-            "amount_max": "Amount Max",
-            "enabled": "Enabled",
-        }
-        gdrive.upload_df(df.rename(columns=export_map), "rules.csv")
+        export_to_drive("rules")
         st.success("Rules uploaded to Google Drive")
     if r_down.button("Download Rules from Drive"):
-        drive_df = gdrive.download_df("rules.csv")
+        drive_df = gdrive.download_df(export_filename("rules"), fallbacks=legacy_filenames("rules"))
         if drive_df is None:
-            st.error("rules.csv not found on Drive")
+            st.error(f"{export_filename('rules')} not found on Drive")
         else:
             rev_map = {
                 "ID": "id",
@@ -174,22 +121,37 @@ with get_session() as s:
                 "Amount Max": "amount_max",
                 "Enabled": "enabled",
             }
-            drive_df = drive_df.rename(columns=rev_map)
-            with get_session() as s:
-                for _, r in drive_df.iterrows():
-                    rid = r.get("id")
-                    rule = s.get(Rule, int(rid)) if pd.notna(rid) else None
-                    if not rule:
-                        rule = Rule()
-                        s.add(rule)
-                    rule.category_id = int(r.get("category_id")) if pd.notna(r.get("category_id")) else None
-                    rule.field = r.get("field")
-                    rule.match_type = r.get("type")
-                    rule.pattern = r.get("pattern")
-                    rule.amount_min = r.get("amount_min") if pd.notna(r.get("amount_min")) else None
-                    rule.amount_max = r.get("amount_max") if pd.notna(r.get("amount_max")) else None
-                    rule.enabled = bool(r.get("enabled", True))
-            st.success("Rules imported from Drive")
+            summary = import_rules(drive_df.rename(columns=rev_map))
+            st.success(f"Rules imported from Drive: {summary}")
+            if summary.has_changes:
+                # manual categories (incl. bulk edits and accepted suggestions) are kept
+                changed = apply_rules_to_all(keep_manual=True)
+                st.info(f"Rules re-applied to {changed} transactions not categorized manually")
+
+def show_impact(report, cat_names):
+    imp = report.candidate
+    if imp is not None:
+        m1, m2, m3, m4 = st.columns(4)
+        m1.metric("Matches", imp.matches)
+        m2.metric("Wins", imp.wins)
+        m3.metric("Newly categorized", imp.new)
+        m4.metric("Shadowed", imp.shadowed)
+        if imp.taken:
+            st.write("Takes from: " + ", ".join(
+                f"{cat_names.get(k, k)} ({v})" for k, v in sorted(imp.taken.items(), key=lambda kv: -kv[1])
+            ))
+        if imp.shadowed_by:
+            st.write("Shadowed by: " + ", ".join(
+                f"{cat_names.get(k, k)} ({v})" for k, v in sorted(imp.shadowed_by.items(), key=lambda kv: -kv[1])
+            ))
+    st.caption(
+        f"{report.changed} transactions would change category; "
+        f"rule-categorized {report.categorized_before} → {report.categorized_after}."
+    )
+
+
+with get_session() as s:
+    cat_names_by_id = {c.id: c.name for c in s.query(Category).all()}
 
 with st.expander("Add Rule"):
     with get_session() as s:
@@ -200,11 +162,43 @@ with st.expander("Add Rule"):
     pattern = st.text_input("Pattern")
     amt_min = st.text_input("Min Amount (optional)")
     amt_max = st.text_input("Max Amount (optional)")
+    try:
+        amount_min = float(amt_min) if amt_min.strip() else None
+        amount_max = float(amt_max) if amt_max.strip() else None
+        amounts_ok = True
+    except ValueError:
+        amount_min = amount_max = None
+        amounts_ok = False
+        st.warning("Min/Max Amount must be numbers.")
+    # simulating runs over every transaction, so only on request (expanders render even when collapsed)
+    if pattern and amounts_ok and st.checkbox("Show impact preview", key="rule_add_preview"):
+        cat_id = next((k for k, v in cat_names_by_id.items() if v == cat_name), None)
+        candidate = Rule(
+            category_id=cat_id,
+            field=field,
+            match_type=mtype,
+            pattern=pattern,
+            amount_min=amount_min,
+            amount_max=amount_max,
+            case_sensitive=False,
+            enabled=True,
+        )
+        show_impact(simulate_rules(candidate), cat_names_by_id)
     if st.button("Save Rule"):
         with get_session() as s:
             c = s.query(Category).filter(Category.name == cat_name).one_or_none()
+            duplicate = c and s.query(Rule).filter(
+                Rule.category_id == c.id,
+                Rule.field == field,
+                Rule.match_type == mtype,
+                Rule.pattern == pattern,
+            ).first()
             if not c:
                 st.error("Category not found")
+            elif not amounts_ok:
+                st.error("Fix the Min/Max Amount before saving")
+            elif duplicate:
+                st.warning(f"Rule #{duplicate.id} already matches this pattern")
             else:
                 s.add(
                     Rule(
@@ -212,8 +206,8 @@ with st.expander("Add Rule"):
                         field=field,
                         match_type=mtype,
                         pattern=pattern,
-                        amount_min=float(amt_min) if amt_min else None,
-                        amount_max=float(amt_max) if amt_max else None,
+                        amount_min=amount_min,
+                        amount_max=amount_max,
                     )
                 )
                 st.success("Rule added")
@@ -230,6 +224,19 @@ with st.expander("Edit / Delete Rule"):
         with get_session() as s:
             rule = s.get(Rule, rule_id)
             enabled = st.checkbox("Enabled", value=rule.enabled, key=f"rule_enabled_{rule_id}")
+            candidate = Rule(
+                id=rule.id,
+                category_id=rule.category_id,
+                field=rule.field,
+                match_type=rule.match_type,
+                pattern=rule.pattern,
+                amount_min=rule.amount_min,
+                amount_max=rule.amount_max,
+                case_sensitive=rule.case_sensitive,
+                enabled=enabled,
+            )
+            if st.checkbox("Show impact preview", key=f"rule_edit_preview_{rule_id}"):
+                show_impact(simulate_rules(candidate, replaces=rule.id), cat_names_by_id)
             c1, c2 = st.columns(2)
             if c1.button("Save", key=f"rule_save_{rule_id}"):
                 rule.enabled = enabled
@@ -252,6 +259,37 @@ st.markdown(
     """
 )
 
+with st.expander("Compact rule set"):
+    st.write("Find duplicate, subsumed and shadowed rules that can be removed without changing any category.")
+    if st.button("Analyze rules"):
+        st.session_state["compaction_plan"] = analyze_rule_compaction()
+    plan = st.session_state.get("compaction_plan")
+    if plan is not None:
+        if not plan.items:
+            st.success("No redundant rules found.")
+        else:
+            k1, k2, k3 = st.columns(3)
+            k1.metric("Enabled rules", plan.rules_before)
+            k2.metric("Removable", len(plan.items))
+            k3.metric("Est. rule application speedup", f"{plan.speedup:.2f}x")
+            st.dataframe(
+                pd.DataFrame(
+                    [
+                        {"rule_id": i.rule_id, "reason": i.reason, "kept_rule_id": i.kept_rule_id, "detail": i.detail}
+                        for i in plan.items
+                    ]
+                ),
+                use_container_width=True,
+                hide_index=True,
+            )
+            to_remove = st.multiselect("Rules to remove", options=plan.rule_ids, default=plan.rule_ids)
+            if st.button("Apply compaction"):
+                removed = apply_compaction(plan, to_remove)
+                del st.session_state["compaction_plan"]
+                st.success(f"Removed {removed} rules")
+        if plan.unused:
+            st.caption(f"Rules matching no transaction yet (kept): {', '.join(f'#{r}' for r in plan.unused)}")
+
 st.divider()
 st.subheader("Apply Rules")
 
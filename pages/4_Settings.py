@@ -1,11 +1,70 @@
 import streamlit as st
+from datetime import datetime
 from pathlib import Path
-from core.db import DB_PATH
+from core.db import db_path
+from core.export import export_all_to_drive
+from core.changes import latest_seq, compact
+from core.partitions import archive_year, archived_years, hot_years, partition_path
+from core.snapshots import (
+    SETTING_INTERVAL_HOURS,
+    SETTING_KEEP,
+    SETTING_LAST,
+    SETTING_MAX_AGE_DAYS,
+    create_download_snapshot,
+    get_schedule,
+    list_snapshots,
+    prune_snapshots,
+    set_schedule,
+)
+from ui import workspace_sidebar
 
+workspace_sidebar()
 st.title("Settings & Data")
 
-st.write(f"Database path: `{DB_PATH}`")
+st.write(f"Database path: `{db_path()}`")
 
-if st.button("Download SQLite database"):
-    with open(DB_PATH, "rb") as f:
-        st.download_button(label="Save expenses.db", data=f, file_name="expenses.db")
+st.subheader("Database snapshots")
+st.caption("Snapshots are consistent, compacted copies taken while the app keeps writing.")
+snap_compress = st.checkbox("Compress (gzip)", value=True)
+if st.button("Create snapshot for download"):
+    st.session_state["snapshot_path"] = create_download_snapshot(compress=snap_compress)
+snap_path = st.session_state.get("snapshot_path")
+if snap_path is not None and snap_path.exists():
+    with open(snap_path, "rb") as f:
+        st.download_button(label=f"Save {snap_path.name}", data=f, file_name=snap_path.name)
+
+with st.expander("Scheduled snapshots"):
+    sched = get_schedule()
+    interval = st.number_input("Interval (hours, 0 = off)", min_value=0.0, value=float(sched[SETTING_INTERVAL_HOURS]), step=1.0)
+    keep = st.number_input("Snapshots to keep", min_value=1, value=int(sched[SETTING_KEEP]), step=1)
+    max_age = st.number_input("Delete snapshots older than (days)", min_value=1, value=int(sched[SETTING_MAX_AGE_DAYS]), step=1)
+    if st.button("Save schedule"):
+        set_schedule(interval, keep, max_age)
+        prune_snapshots(int(keep), max_age)
+        st.success("Snapshot schedule saved")
+    if sched[SETTING_LAST]:
+        st.write(f"Last scheduled snapshot: {sched[SETTING_LAST]:%Y-%m-%d %H:%M}")
+    for p in list_snapshots():
+        st.write(f"`{p.name}` — {p.stat().st_size / 1024:.0f} KiB")
+
+st.subheader("Archive")
+st.caption("Closed years can be moved into read-only archive files; they are only read when a date range reaches into them.")
+for y in archived_years():
+    st.write(f"`{partition_path(y).name}` — {partition_path(y).stat().st_size / 1024:.0f} KiB")
+closed = [y for y in hot_years() if y < datetime.now().year]
+if closed:
+    year = st.selectbox("Closed year", options=closed)
+    if st.button("Archive year"):
+        moved = archive_year(year)
+        st.success(f"Moved {moved} transactions of {year} to the archive")
+
+st.subheader("Google Drive")
+if st.button("Upload transactions, categories and rules to Drive"):
+    ids = export_all_to_drive()
+    st.success(f"Uploaded {', '.join(ids)} to Google Drive")
+
+st.subheader("Change journal")
+journal_seq = latest_seq()
+st.write(f"Latest change sequence number: {journal_seq}")
+if st.button("Compact change journal"):
+    st.success(f"Removed {compact()} processed journal entries")
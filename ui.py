@@ -0,0 +1,29 @@
+import streamlit as st
+from core.db import DEFAULT_WORKSPACE, list_workspaces, set_workspace, workspace_path
+
+# session_state entries that hold data of one workspace (rule ids, file paths)
+WORKSPACE_STATE_KEYS = ("compaction_plan", "snapshot_path")
+
+
+def workspace_sidebar() -> str:
+    """Sidebar workspace selector; binds the chosen workspace for this script run."""
+    names = list_workspaces()
+    current = st.session_state.get("workspace", DEFAULT_WORKSPACE)
+    if current not in names:
+        names.append(current)
+    name = st.sidebar.selectbox("Workspace", options=names, index=names.index(current))
+    with st.sidebar.expander("New workspace"):
+        new_name = st.text_input("Name", key="new_workspace_name")
+        if st.button("Create workspace") and new_name:
+            try:
+                workspace_path(new_name)
+            except ValueError as e:
+                st.error(str(e))
+            else:
+                name = new_name
+    if name != current:
+        for key in WORKSPACE_STATE_KEYS:
+            st.session_state.pop(key, None)
+    st.session_state["workspace"] = name
+    set_workspace(name)
+    return name